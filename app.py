@@ -1,31 +1,110 @@
 # app.py - Versión Completa con correcciones para PostgreSQL y Jinja2
 
 import os
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+import time
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, abort, Response
 from functools import wraps
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from werkzeug.security import check_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from cache import obtener_cacheado
+from limites import limitar, limitar_concurrencia, registrar_fallo, obtener_contadores
+from plantillas import configurar_plantillas
+from compresion import configurar_compresion
+from metricas import configurar_metricas, LOGIN_FALLIDOS
+import perfilador
+import cobertura
+import tiempo_real
 
 # Importar TODAS las funciones necesarias de db_manager
 from db_manager import (
     inicializar_db, registrar_guia, get_guia_data, check_password_hash,
     obtener_todos_los_guias, cambiar_aprobacion, eliminar_guia, promover_a_admin, degradar_a_guia,
+    cambiar_aprobacion_masiva, eliminar_guias_masivo, cambiar_rol_masivo,
     obtener_todos_los_idiomas, agregar_idioma_db, actualizar_idioma_db, eliminar_idioma_db, 
     obtener_idiomas_de_guia, actualizar_idiomas_de_guia, obtener_idiomas_de_multiples_guias,
     actualizar_password_db, actualizar_perfil_db, 
     registrar_queja, obtener_todas_las_quejas, actualizar_estado_queja, eliminar_queja_db,
     agregar_disponibilidad_fecha, obtener_disponibilidad_fechas, eliminar_disponibilidad_fecha,
-    buscar_guias_disponibles_por_fecha
+    buscar_guias_disponibles_por_fecha,
+    encolar_trabajo, obtener_trabajos, obtener_trabajo,
+    obtener_guias_con_mas_quejas_abiertas, obtener_quejas_por_estado, obtener_quejas_por_semana,
+    buscar_quejas, obtener_estado_auth,
+    crear_reserva, confirmar_reserva, cancelar_reserva, obtener_reserva,
+    obtener_reservas_de_guia, obtener_proximas_reservas_de_guia,
+    DATABASE_REPLICA_URLS, iniciar_contexto_lectura, hubo_escritura
 )
 
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'una_clave_secreta_por_defecto_y_muy_larga')
 
+# Caché de bytecode compartida, precompilación de plantillas y etiqueta {% cache %}
+configurar_plantillas(app)
+
+# Latencia por endpoint, peticiones en curso y ruta /metrics (Prometheus)
+configurar_metricas(app)
+
+# Perfilador por muestreo activable desde el panel de administración (sin costo si está apagado)
+perfilador.configurar_perfilador(app)
+
+# Compresión gzip/brotli de respuestas y caché de larga duración para estáticos con huella
+configurar_compresion(app)
+
+# Detrás del balanceador la IP real llega en X-Forwarded-For (necesaria para los límites por IP).
+# Solo se confía en esa cabecera si se configura cuántos proxies hay delante: sin proxy, cualquier
+# cliente podría falsearla para saltarse los límites.
+PROXIES_CONFIABLES = int(os.environ.get('PROXIES_CONFIABLES', '0'))
+if PROXIES_CONFIABLES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXIES_CONFIABLES)
+
+# Segundos que una sesión lee de la primaria después de escribir (read-your-writes con réplicas)
+LECTURA_PRIMARIA_SEGUNDOS = int(os.environ.get('LECTURA_PRIMARIA_SEGUNDOS', '15'))
+
+# Máximo de búsquedas simultáneas antes de responder 503
+BUSQUEDA_MAX_CONCURRENCIA = int(os.environ.get('BUSQUEDA_MAX_CONCURRENCIA', '8'))
+
 # --------------------------------------------------------------------------
 # DECORADORES Y FUNCIONES GLOBALES
 # --------------------------------------------------------------------------
 
+@app.before_request
+def enrutar_lecturas():
+    """Si la sesión escribió hace poco, sus lecturas van a la primaria en lugar de a una réplica."""
+    iniciar_contexto_lectura(forzar_primaria=session.get('leer_primaria_hasta', 0) > time.time())
+
+@app.after_request
+def recordar_escritura(response):
+    if DATABASE_REPLICA_URLS and hubo_escritura() and session.get('logged_in'):
+        session['leer_primaria_hasta'] = time.time() + LECTURA_PRIMARIA_SEGUNDOS
+    return response
+
+def revalidar_sesion():
+    """
+    Comprueba que el rol y la aprobación guardados en la sesión siguen vigentes comparando
+    la auth_version de la sesión con la del guía (consulta en caché, ver obtener_estado_auth).
+    Devuelve False si la sesión debe cerrarse (guía eliminado o desaprobado).
+    """
+    licencia = session.get('user_licencia')
+    try:
+        estado = obtener_estado_auth(licencia)
+    except Exception as e:
+        # Si la base de datos no responde no se cierra la sesión; la página fallará por sí sola
+        print(f"No se pudo revalidar la sesión de {licencia}: {e}")
+        return True
+
+    if estado is None:
+        return False
+    version, rol, aprobado = estado
+    if session.get('auth_version') != version:
+        if aprobado == 0 and rol != 'admin':
+            return False
+        # Rol cambiado (promovido/degradado): actualizar la sesión sin obligar a iniciar sesión otra vez
+        session['user_rol'] = rol
+        session['auth_version'] = version
+    return True
+
 def login_required(f):
     """Decorador para requerir inicio de sesión."""
     @wraps(f)
@@ -33,6 +112,10 @@ def login_required(f):
         if 'logged_in' not in session or not session.get('logged_in'):
             flash('Debes iniciar sesión para acceder a esta página.', 'warning')
             return redirect(url_for('login'))
+        if not revalidar_sesion():
+            session.clear()
+            flash('Tu sesión ya no es válida. Inicia sesión nuevamente.', 'warning')
+            return redirect(url_for('login'))
         return f(*args, **kwargs)
     return decorated_function
 
@@ -46,6 +129,31 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# --------------------------------------------------------------------------
+# DATOS DE CATÁLOGO EN CACHÉ (se invalidan con los grupos 'idiomas' y 'guias')
+# --------------------------------------------------------------------------
+
+def catalogo_idiomas():
+    return obtener_cacheado('idiomas', 'catalogo', 600, obtener_todos_los_idiomas)
+
+def listado_guias():
+    return obtener_cacheado('guias', 'listado', 300, obtener_todos_los_guias)
+
+def _guias_con_idiomas():
+    guias = obtener_todos_los_guias()
+    idiomas_por_guia = obtener_idiomas_de_multiples_guias([g[0] for g in guias])
+    # Fusionar idiomas con los datos de los guías (creando una lista de diccionarios)
+    return [{
+        'licencia': guia[0],
+        'nombre': guia[1],
+        'rol': guia[2],
+        'aprobado': guia[3],
+        'fecha_registro': guia[4],
+        'telefono': guia[5],
+        'email': guia[6],
+        'idiomas': idiomas_por_guia.get(guia[0], 'N/A')
+    } for guia in guias]
+
 
 # --------------------------------------------------------------------------
 # RUTAS PÚBLICAS Y DE AUTENTICACIÓN
@@ -65,22 +173,24 @@ def setup():
 @app.route('/')
 def home():
     # Obtener el catálogo de idiomas para el filtro de búsqueda
-    idiomas_catalogo = obtener_todos_los_idiomas()
+    idiomas_catalogo = catalogo_idiomas()
     return render_template('home.html', idiomas_catalogo=idiomas_catalogo)
 
 @app.route('/login', methods=['GET', 'POST'])
+@limitar('login', capacidad=5, por_minuto=10, por_licencia=True, fallos_por_licencia=(20, 10))
 def login():
     if request.method == 'POST':
         licencia = request.form['licencia'].strip()
         password = request.form['password']
         
-        guia_data = get_guia_data(licencia, all_data=False) # Obtiene (password_hash, rol, aprobado)
+        guia_data = get_guia_data(licencia, all_data=False) # Obtiene (password_hash, rol, aprobado, auth_version)
 
         if guia_data and check_password_hash(guia_data[0], password):
             rol = guia_data[1]
             aprobado = guia_data[2]
             
             if aprobado == 0 and rol != 'admin':
+                LOGIN_FALLIDOS.labels('pendiente_aprobacion').inc()
                 flash('Tu cuenta aún está pendiente de aprobación por el administrador.', 'warning')
                 return redirect(url_for('login'))
             
@@ -88,12 +198,15 @@ def login():
             session['logged_in'] = True
             session['user_licencia'] = licencia
             session['user_rol'] = rol
+            session['auth_version'] = guia_data[3]
             
             if rol == 'admin':
                 return redirect(url_for('panel_admin'))
             else:
                 return redirect(url_for('panel_guia'))
         else:
+            LOGIN_FALLIDOS.labels('credenciales_invalidas').inc()
+            registrar_fallo('login')
             flash('Credenciales inválidas.', 'error')
     
     return render_template('login.html')
@@ -153,7 +266,7 @@ def editar_mi_perfil():
         'bio': guia_info_tuple[7] if guia_info_tuple[7] else ''
     }
     
-    idiomas_catalogo = obtener_todos_los_idiomas()
+    idiomas_catalogo = catalogo_idiomas()
     idiomas_seleccionados_ids = obtener_idiomas_de_guia(licencia)
 
     if request.method == 'POST':
@@ -224,8 +337,38 @@ def gestionar_disponibilidad():
             
         return redirect(url_for('gestionar_disponibilidad'))
 
-    disponibilidad = obtener_disponibilidad_fechas(licencia)
-    return render_template('disponibilidad.html', disponibilidad=disponibilidad)
+    disponibilidades = obtener_disponibilidad_fechas(licencia)
+    return render_template('disponibilidad.html', disponibilidades=disponibilidades)
+
+@app.route('/disponibilidad_rango', methods=['POST'])
+@login_required
+def agregar_disponibilidad_rango():
+    """Registra el mismo horario para un rango de fechas. La escritura se hace en el worker."""
+    licencia = session.get('user_licencia')
+    hora_inicio = request.form.get('hora_inicio')
+    hora_fin = request.form.get('hora_fin')
+
+    try:
+        desde = datetime.strptime(request.form.get('fecha_desde', ''), '%Y-%m-%d').date()
+        hasta = datetime.strptime(request.form.get('fecha_hasta', ''), '%Y-%m-%d').date()
+        datetime.strptime(hora_inicio, '%H:%M')
+        datetime.strptime(hora_fin, '%H:%M')
+    except (ValueError, TypeError):
+        flash('Formato de fecha u hora inválido.', 'error')
+        return redirect(url_for('gestionar_disponibilidad'))
+
+    desde = max(desde, date.today())
+    if hasta < desde or (hasta - desde).days > 366:
+        flash('Rango de fechas inválido (máximo un año, sin fechas pasadas).', 'error')
+        return redirect(url_for('gestionar_disponibilidad'))
+
+    franjas = [((desde + timedelta(days=i)).isoformat(), hora_inicio, hora_fin)
+               for i in range((hasta - desde).days + 1)]
+    if encolar_trabajo('disponibilidad_masiva', {'licencia': licencia, 'franjas': franjas}, creado_por=licencia):
+        flash(f'Se están registrando {len(franjas)} fechas. Aparecerán en unos instantes.', 'success')
+    else:
+        flash('Error al programar el registro de disponibilidad.', 'error')
+    return redirect(url_for('gestionar_disponibilidad'))
 
 @app.route('/eliminar_disponibilidad/<int:fecha_id>', methods=['POST'])
 @login_required
@@ -234,12 +377,13 @@ def eliminar_disponibilidad(fecha_id):
     if eliminar_disponibilidad_fecha(fecha_id, licencia):
         flash('Disponibilidad eliminada.', 'success')
     else:
-        flash('Error al eliminar disponibilidad.', 'error')
+        flash('Error al eliminar disponibilidad (el turno puede tener una reserva activa).', 'error')
     return redirect(url_for('gestionar_disponibilidad'))
 
 @app.route('/reportar_queja', methods=['GET', 'POST'])
+@limitar('reportar_queja', capacidad=3, por_minuto=2)
 def reportar_queja():
-    guias = obtener_todos_los_guias() # Se podría optimizar, pero funciona para un listado
+    guias = listado_guias()
     
     if request.method == 'POST':
         licencia_guia = request.form.get('licencia_guia')
@@ -255,6 +399,8 @@ def reportar_queja():
     return render_template('reportar_queja.html', guias=guias)
 
 @app.route('/buscar_guia', methods=['POST'])
+@limitar('buscar_guia', capacidad=20, por_minuto=30)
+@limitar_concurrencia('buscar_guia', BUSQUEDA_MAX_CONCURRENCIA)
 def buscar_guia():
     fecha_str = request.form.get('fecha')
     idioma_id = request.form.get('idioma')
@@ -276,13 +422,118 @@ def buscar_guia():
     guias_disponibles = buscar_guias_disponibles_por_fecha(fecha_buscada, idioma_id)
     
     # Obtener el nombre del idioma buscado para mostrar en el resultado
-    idiomas_catalogo = {i[0]: i[1] for i in obtener_todos_los_idiomas()}
+    idiomas_catalogo = {i[0]: i[1] for i in catalogo_idiomas()}
     idioma_nombre = idiomas_catalogo.get(idioma_id) if idioma_id else "Cualquier idioma"
     
     return render_template('resultados_busqueda.html', 
                            guias=guias_disponibles, 
                            fecha=fecha_buscada.strftime('%d-%m-%Y'),
-                           idioma_nombre=idioma_nombre)
+                           idioma_nombre=idioma_nombre,
+                           url_eventos=url_for('eventos_disponibilidad', fecha=fecha_buscada.isoformat(),
+                                               idioma=idioma_id or None))
+
+
+# --------------------------------------------------------------------------
+# EVENTOS EN VIVO (server-sent events, ver tiempo_real.py)
+# --------------------------------------------------------------------------
+
+# Las plantillas solo abren el EventSource si los eventos en vivo están activos
+app.jinja_env.globals['eventos_en_vivo'] = tiempo_real.EVENTOS_EN_VIVO
+
+def _respuesta_eventos(clave):
+    if not tiempo_real.EVENTOS_EN_VIVO:
+        # 204 indica al navegador que no vuelva a conectarse
+        return Response(status=204)
+    suscriptor = tiempo_real.obtener_oyente().suscribir(clave)
+    if suscriptor is None:
+        # Sin cupo en este proceso: el navegador reintenta según 'retry' / Retry-After
+        return Response('Demasiadas conexiones en vivo.', status=503, headers={'Retry-After': '30'})
+    return Response(tiempo_real.stream_eventos(suscriptor), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/disponibilidad/eventos')
+@limitar('eventos', capacidad=10, por_minuto=30, metodos=('GET',))
+def eventos_disponibilidad():
+    """Cambios en vivo de los resultados de una búsqueda (fecha y, opcionalmente, idioma)."""
+    try:
+        fecha = datetime.strptime(request.args.get('fecha', ''), '%Y-%m-%d').date()
+    except ValueError:
+        abort(400)
+    return _respuesta_eventos(tiempo_real.clave_busqueda(fecha, request.args.get('idioma', type=int)))
+
+@app.route('/mi_disponibilidad/eventos')
+@login_required
+def eventos_mi_disponibilidad():
+    """Cambios en vivo de los turnos del guía (nuevos, eliminados, reservados)."""
+    return _respuesta_eventos(tiempo_real.clave_guia(session.get('user_licencia')))
+
+
+# --------------------------------------------------------------------------
+# RUTAS DE RESERVAS
+# --------------------------------------------------------------------------
+# El turista retiene un turno desde los resultados de búsqueda y lo confirma con el código
+# recibido. La base de datos impide la doble reserva (ver crear_reserva en db_manager).
+
+@app.route('/reservar/<int:disponibilidad_id>', methods=['POST'])
+@limitar('reservar', capacidad=5, por_minuto=10)
+def reservar(disponibilidad_id):
+    cliente_nombre = (request.form.get('cliente_nombre') or '').strip()
+    cliente_contacto = (request.form.get('cliente_contacto') or '').strip()
+    if not cliente_nombre or not cliente_contacto:
+        flash('Indica tu nombre y un teléfono o email de contacto para reservar.', 'error')
+        return redirect(url_for('home'))
+
+    codigo = crear_reserva(disponibilidad_id, cliente_nombre[:255], cliente_contacto[:255])
+    if not codigo:
+        flash('Ese turno ya no está disponible. Realiza una nueva búsqueda.', 'error')
+        return redirect(url_for('home'))
+
+    flash('Turno retenido. Confírmalo antes de que venza la retención.', 'success')
+    return redirect(url_for('ver_reserva', codigo=codigo))
+
+@app.route('/reserva/<codigo>')
+def ver_reserva(codigo):
+    reserva = obtener_reserva(codigo)
+    if not reserva:
+        abort(404)
+    return render_template('reserva.html', reserva=reserva)
+
+@app.route('/reserva/<codigo>/confirmar', methods=['POST'])
+def confirmar_reserva_cliente(codigo):
+    if confirmar_reserva(codigo):
+        flash('Reserva confirmada. El guía ya puede verla en su panel.', 'success')
+    else:
+        flash('No se pudo confirmar: la retención venció o la reserva ya no está activa.', 'error')
+    return redirect(url_for('ver_reserva', codigo=codigo))
+
+@app.route('/reserva/<codigo>/cancelar', methods=['POST'])
+def cancelar_reserva_cliente(codigo):
+    if cancelar_reserva(codigo=codigo):
+        flash('Reserva cancelada. El turno vuelve a estar disponible.', 'success')
+    else:
+        flash('La reserva no se puede cancelar (ya no está activa o la fecha pasó).', 'error')
+    return redirect(url_for('ver_reserva', codigo=codigo))
+
+@app.route('/mis_reservas')
+@login_required
+def ver_reservas():
+    reservas = obtener_proximas_reservas_de_guia(session.get('user_licencia'))
+    return render_template('ver_reservas.html', reservas=reservas)
+
+@app.route('/mis_reservas/<int:reserva_id>/cancelar', methods=['POST'])
+@login_required
+def cancelar_reserva_guia(reserva_id):
+    if cancelar_reserva(reserva_id=reserva_id, licencia_guia=session.get('user_licencia')):
+        flash('Reserva cancelada.', 'success')
+    else:
+        flash('No se pudo cancelar la reserva.', 'error')
+    return redirect(url_for('ver_reservas'))
+
+@app.route('/historial_reservas')
+@login_required
+def historial_reservas():
+    reservas = obtener_reservas_de_guia(session.get('user_licencia'))
+    return render_template('historial_reservas.html', reservas=reservas)
 
 
 # --------------------------------------------------------------------------
@@ -299,27 +550,7 @@ def panel_admin():
 @login_required
 @admin_required
 def gestion_guias():
-    guias = obtener_todos_los_guias()
-    
-    # Obtener idiomas para cada guía
-    licencias = [g[0] for g in guias]
-    idiomas_por_guia = obtener_idiomas_de_multiples_guias(licencias)
-    
-    # Fusionar idiomas con los datos de los guías (creando una lista de diccionarios)
-    guias_data = []
-    for guia in guias:
-        guia_dict = {
-            'licencia': guia[0],
-            'nombre': guia[1],
-            'rol': guia[2],
-            'aprobado': guia[3],
-            'fecha_registro': guia[4],
-            'telefono': guia[5],
-            'email': guia[6],
-            'idiomas': idiomas_por_guia.get(guia[0], 'N/A')
-        }
-        guias_data.append(guia_dict)
-        
+    guias_data = obtener_cacheado('guias', 'gestion', 300, _guias_con_idiomas)
     return render_template('gestion_guias.html', guias=guias_data)
 
 
@@ -373,6 +604,40 @@ def degradar(licencia):
         flash('Error al degradar o es el administrador principal.', 'error')
     return redirect(url_for('gestion_guias'))
 
+# Acción masiva -> (función de db_manager, mensaje de éxito)
+ACCIONES_MASIVAS = {
+    'aprobar': (lambda licencias: cambiar_aprobacion_masiva(licencias, 1), 'aprobados'),
+    'rechazar': (lambda licencias: cambiar_aprobacion_masiva(licencias, 0), 'rechazados'),
+    'eliminar': (eliminar_guias_masivo, 'eliminados permanentemente'),
+    'promover': (lambda licencias: cambiar_rol_masivo(licencias, 'admin'), 'promovidos a Administrador'),
+    'degradar': (lambda licencias: cambiar_rol_masivo(licencias, 'guia'), 'degradados a Guía'),
+}
+
+@app.route('/acciones_masivas_guias', methods=['POST'])
+@login_required
+@admin_required
+def acciones_masivas_guias():
+    accion = request.form.get('accion')
+    licencias = [l.strip() for l in request.form.getlist('licencias') if l.strip()]
+
+    if accion not in ACCIONES_MASIVAS:
+        flash('Acción masiva inválida.', 'error')
+        return redirect(url_for('gestion_guias'))
+    if not licencias:
+        flash('Debe seleccionar al menos un guía.', 'warning')
+        return redirect(url_for('gestion_guias'))
+
+    funcion, mensaje = ACCIONES_MASIVAS[accion]
+    resultados = funcion(licencias)
+
+    exitosas = [l for l, ok in resultados.items() if ok]
+    fallidas = [l for l, ok in resultados.items() if not ok]
+    if exitosas:
+        flash(f'{len(exitosas)} guía(s) {mensaje}: {", ".join(exitosas)}.', 'success')
+    if fallidas:
+        flash(f'Sin cambios para {len(fallidas)} guía(s) (no existen, ya estaban en ese estado o es el administrador principal): {", ".join(fallidas)}.', 'warning')
+    return redirect(url_for('gestion_guias'))
+
 @app.route('/gestion_idiomas', methods=['GET', 'POST'])
 @login_required
 @admin_required
@@ -385,7 +650,7 @@ def gestion_idiomas():
             flash('Error: El idioma ya existe o el nombre es inválido.', 'error')
         return redirect(url_for('gestion_idiomas'))
 
-    idiomas = obtener_todos_los_idiomas()
+    idiomas = catalogo_idiomas()
     return render_template('gestion_idiomas.html', idiomas=idiomas)
 
 @app.route('/actualizar_idioma/<int:idioma_id>', methods=['POST'])
@@ -409,13 +674,107 @@ def eliminar_idioma(idioma_id):
         flash('Error al eliminar el idioma.', 'error')
     return redirect(url_for('gestion_idiomas'))
 
+QUEJAS_POR_PAGINA = 50
+
 @app.route('/gestion_quejas')
 @login_required
 @admin_required
 def gestion_quejas():
-    # CORRECCIÓN DE ERROR DE PLANTILLA FALTANTE (gestion_quejas.html)
-    quejas = obtener_todas_las_quejas_para_guias()
-    return render_template('gestion_quejas.html', quejas=quejas)
+    # Filtros opcionales por querystring: estado, licencia, desde, hasta, q (texto), pagina
+    filtros = {
+        'estado': request.args.get('estado', '').strip(),
+        'licencia': request.args.get('licencia', '').strip(),
+        'desde': request.args.get('desde', '').strip(),
+        'hasta': request.args.get('hasta', '').strip(),
+        'q': request.args.get('q', '').strip(),
+    }
+    pagina = request.args.get('pagina', 1, type=int)
+
+    try:
+        desde = datetime.strptime(filtros['desde'], '%Y-%m-%d').date() if filtros['desde'] else None
+        hasta = datetime.strptime(filtros['hasta'], '%Y-%m-%d').date() if filtros['hasta'] else None
+    except ValueError:
+        flash('Formato de fecha inválido en el filtro.', 'error')
+        desde = hasta = None
+
+    quejas, total, pagina, es_minimo = buscar_quejas(estado=filtros['estado'] or None,
+                                                     licencia_guia=filtros['licencia'] or None,
+                                                     desde=desde, hasta=hasta,
+                                                     texto=filtros['q'] or None,
+                                                     pagina=pagina, por_pagina=QUEJAS_POR_PAGINA)
+    if es_minimo:
+        # Conteo truncado: no se conoce la última página; hay siguiente si esta vino completa
+        total_paginas = None
+        hay_siguiente = len(quejas) == QUEJAS_POR_PAGINA
+    else:
+        total_paginas = max((total + QUEJAS_POR_PAGINA - 1) // QUEJAS_POR_PAGINA, 1)
+        hay_siguiente = pagina < total_paginas
+
+    return render_template('gestion_quejas.html', quejas=quejas, total=total, total_es_minimo=es_minimo,
+                           pagina=pagina, total_paginas=total_paginas, hay_siguiente=hay_siguiente, filtros=filtros,
+                           estados_filtro=[estado for estado, _ in obtener_quejas_por_estado()])
+
+@app.route('/analitica_quejas')
+@login_required
+@admin_required
+def analitica_quejas():
+    return render_template('analitica_quejas.html',
+                           top_guias=obtener_guias_con_mas_quejas_abiertas(),
+                           por_estado=obtener_quejas_por_estado(),
+                           por_semana=obtener_quejas_por_semana())
+
+@app.route('/recalcular_analitica_quejas', methods=['POST'])
+@login_required
+@admin_required
+def recalcular_analitica_quejas():
+    trabajo_id = encolar_trabajo('recalcular_resumen_quejas', creado_por=session.get('user_licencia'))
+    if trabajo_id:
+        flash(f'Recálculo de la analítica programado (trabajo #{trabajo_id}).', 'success')
+    else:
+        flash('Error al programar el recálculo de la analítica.', 'error')
+    return redirect(url_for('analitica_quejas'))
+
+COBERTURA_MAX_DIAS = 366
+
+def _reporte_cobertura_solicitado():
+    """Lee desde/dias de la URL y genera el reporte. Devuelve (reporte, desde, dias)."""
+    try:
+        desde = datetime.strptime(request.args.get('desde', ''), '%Y-%m-%d').date()
+    except ValueError:
+        desde = date.today()
+    dias = min(max(request.args.get('dias', 90, type=int), 1), COBERTURA_MAX_DIAS)
+    return cobertura.generar_reporte(desde, dias, catalogo_idiomas()), desde, dias
+
+@app.route('/cobertura')
+@login_required
+@admin_required
+def reporte_cobertura():
+    """Mapa de calor fecha x idioma: guías libres a la hora elegida o en la hora de mayor cobertura."""
+    reporte, desde, dias = _reporte_cobertura_solicitado()
+    hora = request.args.get('hora', type=int)
+    if hora is not None and not 0 <= hora < cobertura.HORAS:
+        hora = None
+
+    valores, maximo = [], 0
+    if reporte is None:
+        flash('Error al generar el reporte de cobertura.', 'error')
+    else:
+        matriz = reporte['cobertura'][:, :, hora] if hora is not None else reporte['cobertura'].max(axis=2)
+        valores = matriz.tolist()
+        maximo = int(matriz.max(initial=0))
+    return render_template('cobertura.html', reporte=reporte, valores=valores, maximo=maximo,
+                           desde=desde, dias=dias, hora=hora)
+
+@app.route('/cobertura.csv')
+@login_required
+@admin_required
+def descargar_cobertura():
+    reporte, desde, dias = _reporte_cobertura_solicitado()
+    if reporte is None:
+        flash('Error al generar el reporte de cobertura.', 'error')
+        return redirect(url_for('reporte_cobertura'))
+    return Response(cobertura.exportar_csv(reporte), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename=cobertura-{desde.isoformat()}-{dias}d.csv'})
 
 @app.route('/actualizar_estado_queja/<int:queja_id>', methods=['POST'])
 @login_required
@@ -438,6 +797,78 @@ def eliminar_queja(queja_id):
         flash('Error al eliminar la queja.', 'error')
     return redirect(url_for('gestion_quejas'))
 
+@app.route('/trabajos')
+@login_required
+@admin_required
+def gestion_trabajos():
+    trabajos = obtener_trabajos()
+    return render_template('gestion_trabajos.html', trabajos=trabajos)
+
+@app.route('/limites')
+@login_required
+@admin_required
+def estado_limites():
+    """Contadores de solicitudes permitidas/rechazadas/descartadas de este worker."""
+    return jsonify(obtener_contadores())
+
+@app.route('/perfilador')
+@login_required
+@admin_required
+def gestion_perfilador():
+    return render_template('perfilador.html', estado=perfilador.estado())
+
+@app.route('/perfilador/activar', methods=['POST'])
+@login_required
+@admin_required
+def activar_perfilador():
+    try:
+        fraccion = float(request.form.get('porcentaje', '5')) / 100
+        minutos = int(request.form.get('minutos', '5'))
+    except ValueError:
+        flash('Valores inválidos para el perfilador.', 'error')
+        return redirect(url_for('gestion_perfilador'))
+
+    if not (0 < fraccion <= 1) or not (1 <= minutos <= 60):
+        flash('El porcentaje debe estar entre 0 y 100 y la duración entre 1 y 60 minutos.', 'error')
+    else:
+        perfilador.activar(fraccion, minutos)
+        flash(f'Perfilador activo durante {minutos} minutos en el {fraccion * 100:g}% de las peticiones.', 'success')
+    return redirect(url_for('gestion_perfilador'))
+
+@app.route('/perfilador/desactivar', methods=['POST'])
+@login_required
+@admin_required
+def desactivar_perfilador():
+    perfilador.desactivar()
+    flash('Perfilador desactivado.', 'success')
+    return redirect(url_for('gestion_perfilador'))
+
+@app.route('/perfilador/limpiar', methods=['POST'])
+@login_required
+@admin_required
+def limpiar_perfilador():
+    perfilador.limpiar_muestras()
+    flash('Muestras eliminadas.', 'success')
+    return redirect(url_for('gestion_perfilador'))
+
+@app.route('/perfilador/descargar')
+@login_required
+@admin_required
+def descargar_perfilador():
+    """Pilas agregadas en formato folded (flamegraph.pl, speedscope)."""
+    return Response(perfilador.obtener_pilas_agregadas(), mimetype='text/plain',
+                    headers={'Content-Disposition': f'attachment; filename=perfil-{datetime.now():%Y%m%d-%H%M}.folded'})
+
+@app.route('/trabajos/<int:trabajo_id>')
+@login_required
+@admin_required
+def estado_trabajo(trabajo_id):
+    """Estado de un trabajo en JSON, para consultarlo periódicamente (polling)."""
+    trabajo = obtener_trabajo(trabajo_id)
+    if not trabajo:
+        abort(404)
+    return jsonify(trabajo)
+
 
 if __name__ == '__main__':
     # Usamos Gunicorn para producción, pero flask run es para desarrollo local
@@ -0,0 +1,73 @@
+# benchmark_cobertura.py - Mide el cálculo del reporte de cobertura (cobertura.py) con datos
+# sintéticos y lo compara con un cálculo directo, turno por turno, sobre una muestra.
+#
+# Uso: python benchmark_cobertura.py [guias] [dias] [idiomas]
+# No necesita base de datos: genera la misma salida de texto que COPY en obtener_datos_cobertura.
+
+import sys
+import time
+
+import numpy as np
+
+from cobertura import HORAS, calcular_cobertura, parsear_copy
+
+
+def generar_datos(n_guias, dias, n_idiomas, semilla=0):
+    rng = np.random.default_rng(semilla)
+    # Cada guía está libre ~70% de los días, con turnos de 2 a 10 horas entre las 5 y las 22
+    guia, dia = np.nonzero(rng.random((n_guias, dias)) < 0.7)
+    inicio = rng.integers(5, 14, len(guia))
+    fin = np.minimum(inicio + rng.integers(2, 11, len(guia)), HORAS)
+    turnos = np.column_stack([guia, dia, inicio, fin])
+    # De 1 a 3 idiomas por guía
+    pares = {(g, int(i)) for g in range(n_guias) for i in rng.choice(n_idiomas, rng.integers(1, 4), replace=False)}
+    idiomas_guia = np.array(sorted(pares))
+    return turnos, idiomas_guia
+
+def como_copy(arreglo):
+    return '\n'.join('\t'.join(map(str, fila)) for fila in arreglo.tolist()) + '\n'
+
+def calculo_directo(turnos, idiomas_guia, dias, n_idiomas):
+    idiomas_por_guia = {}
+    for g, i in idiomas_guia.tolist():
+        idiomas_por_guia.setdefault(g, []).append(i)
+    cobertura = np.zeros((dias, n_idiomas, HORAS), dtype=np.int32)
+    for g, d, inicio, fin in turnos.tolist():
+        for i in idiomas_por_guia.get(g, []):
+            cobertura[d, i, inicio:fin] += 1
+    return cobertura
+
+def main():
+    n_guias = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    dias = int(sys.argv[2]) if len(sys.argv) > 2 else 365
+    n_idiomas = int(sys.argv[3]) if len(sys.argv) > 3 else 12
+
+    turnos, idiomas_guia = generar_datos(n_guias, dias, n_idiomas)
+    texto_turnos, texto_idiomas = como_copy(turnos), como_copy(idiomas_guia)
+    print(f"{n_guias:,} guías, {dias} días, {n_idiomas} idiomas: {len(turnos):,} turnos, "
+          f"{len(idiomas_guia):,} pares guía-idioma ({(len(texto_turnos) + len(texto_idiomas)) / 1e6:.1f} MB de COPY)")
+
+    inicio = time.perf_counter()
+    turnos_leidos = parsear_copy(texto_turnos, 4)
+    idiomas_leidos = parsear_copy(texto_idiomas, 2)
+    parseo = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    cobertura = calcular_cobertura(turnos_leidos, idiomas_leidos, dias, list(range(n_idiomas)))
+    calculo = time.perf_counter() - inicio
+    print(f"Parseo de COPY: {parseo * 1000:.0f} ms | Matriz {cobertura.shape}: {calculo * 1000:.0f} ms")
+
+    # Verificación contra el cálculo directo sobre los primeros 500 guías
+    muestra = 500
+    parcial = calcular_cobertura(turnos[turnos[:, 0] < muestra], idiomas_guia[idiomas_guia[:, 0] < muestra],
+                                 dias, list(range(n_idiomas)))
+    inicio = time.perf_counter()
+    esperado = calculo_directo(turnos[turnos[:, 0] < muestra], idiomas_guia[idiomas_guia[:, 0] < muestra],
+                               dias, n_idiomas)
+    directo = time.perf_counter() - inicio
+    print(f"Cálculo directo para {muestra} guías: {directo * 1000:.0f} ms | "
+          f"{'coincide' if np.array_equal(parcial, esperado) else 'NO COINCIDE'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# benchmark_compresion.py - Mide los bytes transferidos por las páginas más pesadas
+# sin compresión, con gzip y con brotli (si está instalado), usando datos sintéticos.
+#
+# Uso: python benchmark_compresion.py [cantidad_de_filas]
+# No necesita base de datos: renderiza las plantillas directamente con Jinja2.
+
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+from compresion import comprimir, brotli
+from plantillas import FragmentCacheExtension
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+
+
+def crear_entorno():
+    env = Environment(loader=FileSystemLoader(os.path.join(DIRECTORIO, 'templates')),
+                      autoescape=select_autoescape(['html']),
+                      extensions=[FragmentCacheExtension])
+    env.globals.update(
+        url_for=lambda endpoint, **kwargs: f"/{endpoint}",
+        get_flashed_messages=lambda with_categories=False: [],
+        session={'user_licencia': 'ADMIN001'},
+    )
+    return env
+
+def datos_gestion_guias(n):
+    ahora = datetime.now()
+    return {'guias': [(f"LIC{i:05d}", f"Guía de Prueba {i}", 'admin' if i % 50 == 0 else 'guia', i % 3 != 0,
+                       ahora - timedelta(days=i), '984000000', f"guia{i}@ejemplo.com") for i in range(n)]}
+
+def datos_gestion_quejas(n):
+    ahora = datetime.now()
+    estados = ['pendiente', 'en revision', 'resuelta']
+    quejas = [(i, f"LIC{i % 300:05d}", f"Guía de Prueba {i % 300}", ahora - timedelta(hours=i),
+               "El guía llegó tarde al punto de encuentro y no explicó el recorrido completo. " * 2,
+               estados[i % 3], f"Turista {i}") for i in range(n)]
+    return {'quejas': quejas, 'total': n, 'pagina': 1, 'total_paginas': 1,
+            'filtros': {'estado': '', 'licencia': '', 'desde': '', 'hasta': '', 'q': ''},
+            'estados_filtro': estados}
+
+def medir(nombre, html):
+    datos = html.encode('utf-8')
+    fila = [nombre, len(datos)]
+    inicio = time.perf_counter()
+    fila.append(len(comprimir(datos, 'gzip')))
+    fila.append((time.perf_counter() - inicio) * 1000)
+    if brotli is not None:
+        inicio = time.perf_counter()
+        fila.append(len(comprimir(datos, 'br')))
+        fila.append((time.perf_counter() - inicio) * 1000)
+    return fila
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    env = crear_entorno()
+
+    resultados = [
+        medir(f"gestion_guias.html ({n} guías)", env.get_template('gestion_guias.html').render(**datos_gestion_guias(n))),
+        medir(f"gestion_quejas.html ({n} quejas)", env.get_template('gestion_quejas.html').render(**datos_gestion_quejas(n))),
+        medir("disponibilidad.html (base.html)", env.get_template('disponibilidad.html').render(disponibilidades=[])),
+    ]
+
+    encabezado = f"{'Página':<36}{'Original':>11}{'gzip':>10}{'ms':>7}"
+    if brotli is not None:
+        encabezado += f"{'brotli':>10}{'ms':>7}"
+    print(encabezado)
+    for fila in resultados:
+        linea = f"{fila[0]:<36}{fila[1]:>11,}{fila[2]:>10,}{fila[3]:>7.1f}"
+        if brotli is not None:
+            linea += f"{fila[4]:>10,}{fila[5]:>7.1f}"
+        print(linea)
+
+    css = os.path.getsize(os.path.join(DIRECTORIO, 'static', 'css', 'base.css'))
+    print(f"\nCSS de base.html extraído a static/css/base.css: {css:,} bytes que ya no se repiten en cada página "
+          f"(se descargan una vez y se cachean por un año).")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+# cache.py - Caché clave/valor con TTL compartido por app.py y db_manager.py.
+#
+# Por defecto la caché vive en memoria del proceso (un diccionario por worker de gunicorn).
+# Si se define la variable de entorno REDIS_URL y el paquete 'redis' está instalado,
+# se usa Redis y la caché queda compartida entre todos los workers y servidores.
+
+import os
+import pickle
+import threading
+import time
+
+from metricas import CACHE_CONSULTAS
+
+try:
+    import redis
+except ImportError:  # Dependencia opcional
+    redis = None
+
+
+class CacheMemoria:
+    """Caché en memoria del proceso, segura entre hilos."""
+
+    def __init__(self):
+        self._datos = {}
+        self._lock = threading.Lock()
+
+    def get(self, clave):
+        with self._lock:
+            item = self._datos.get(clave)
+            if item is None:
+                return None
+            valor, expira = item
+            if expira is not None and expira < time.monotonic():
+                del self._datos[clave]
+                return None
+            return valor
+
+    def set(self, clave, valor, ttl=None):
+        expira = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._datos[clave] = (valor, expira)
+
+    def delete(self, *claves):
+        with self._lock:
+            for clave in claves:
+                self._datos.pop(clave, None)
+
+
+class CacheRedis:
+    """
+    Caché en Redis. Los valores se serializan con pickle para que vuelvan con los mismos tipos
+    que en CacheMemoria (tuplas, fechas, datetime); con JSON una plantilla se vería distinta
+    según el backend. Redis es un servicio propio, no una fuente de datos externa.
+    """
+
+    def __init__(self, url):
+        self._redis = redis.Redis.from_url(url, socket_timeout=0.5)
+
+    def get(self, clave):
+        try:
+            valor = self._redis.get(clave)
+        except redis.RedisError:
+            return None  # Si Redis falla se comporta como un fallo de caché
+        if valor is None:
+            return None
+        try:
+            return pickle.loads(valor)
+        except Exception:
+            return None  # Entrada ilegible (p. ej. escrita en JSON por una versión anterior): fallo de caché
+
+    def set(self, clave, valor, ttl=None):
+        try:
+            self._redis.set(clave, pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL), ex=ttl)
+        except redis.RedisError:
+            pass
+
+    def delete(self, *claves):
+        if not claves:
+            return
+        try:
+            self._redis.delete(*claves)
+        except redis.RedisError:
+            pass
+
+
+def crear_cache():
+    url = os.environ.get('REDIS_URL')
+    if url and redis is not None:
+        return CacheRedis(url)
+    if url:
+        print("Aviso: REDIS_URL está definida pero el paquete 'redis' no está instalado. Se usa caché en memoria.")
+    return CacheMemoria()
+
+
+class CacheMedida:
+    """Envuelve la caché para contar aciertos y fallos por espacio de claves (prefijo antes de ':')."""
+
+    def __init__(self, cache):
+        self._cache = cache
+
+    def get(self, clave):
+        valor = self._cache.get(clave)
+        CACHE_CONSULTAS.labels(clave.split(':', 1)[0], 'acierto' if valor is not None else 'fallo').inc()
+        return valor
+
+    def set(self, clave, valor, ttl=None):
+        self._cache.set(clave, valor, ttl)
+
+    def delete(self, *claves):
+        self._cache.delete(*claves)
+
+
+_cache_base = crear_cache()
+cache = CacheMedida(_cache_base)
+CACHE_COMPARTIDA = isinstance(_cache_base, CacheRedis)
+
+# --------------------------------------------------------------------------
+# GRUPOS DE INVALIDACIÓN
+# --------------------------------------------------------------------------
+# Las entradas que dependen de un grupo de datos (p. ej. 'idiomas', 'guias') incluyen la
+# versión del grupo en su clave; invalidar el grupo cambia la versión y deja obsoletas
+# todas sus entradas a la vez, sin tener que conocerlas.
+#
+# Con Redis la versión vive en la propia caché compartida. Sin Redis cada worker tiene su
+# caché, pero la versión debe ser la misma para todos los procesos (otros workers, worker.py,
+# otros servidores): se lee de la tabla CACHE_VERSIONES, que los triggers de db_manager
+# incrementan al modificar los datos, y se relee como máximo cada VERSIONES_SEGUNDOS.
+
+VERSIONES_SEGUNDOS = float(os.environ.get('CACHE_VERSIONES_SEGUNDOS', '2'))
+
+_versiones = {'valores': None, 'leido': float('-inf')}
+_versiones_lock = threading.Lock()
+
+def _versiones_de_db():
+    with _versiones_lock:
+        if time.monotonic() - _versiones['leido'] >= VERSIONES_SEGUNDOS:
+            from db_manager import obtener_versiones_cache
+            _versiones['valores'] = obtener_versiones_cache()
+            _versiones['leido'] = time.monotonic()
+        return _versiones['valores']
+
+def version_grupo(grupo):
+    """Versión actual del grupo, o None si no se puede conocer (en ese caso no se usa la caché)."""
+    if CACHE_COMPARTIDA:
+        return cache.get(f"grupo:{grupo}") or 0
+    versiones = _versiones_de_db()
+    return None if versiones is None else versiones.get(grupo, 0)
+
+def invalidar_grupo(*grupos):
+    if CACHE_COMPARTIDA:
+        for grupo in grupos:
+            cache.set(f"grupo:{grupo}", time.time_ns())
+    else:
+        # Los triggers ya incrementaron la versión: este proceso la relee en la próxima consulta
+        with _versiones_lock:
+            _versiones['leido'] = float('-inf')
+
+def obtener_cacheado(grupo, nombre, ttl, calcular):
+    """
+    Devuelve calcular() guardado durante 'ttl' segundos bajo la versión actual del grupo.
+    Los resultados vacíos no se guardan (las funciones de db_manager devuelven [] ante un error).
+    """
+    version = version_grupo(grupo)
+    if version is None:
+        return calcular()
+    clave = f"datos:{grupo}:{version}:{nombre}"
+    valor = cache.get(clave)
+    if valor is None:
+        valor = calcular()
+        if valor:
+            cache.set(clave, valor, ttl)
+    return valor
@@ -0,0 +1,97 @@
+# cobertura.py - Reporte de cobertura: guías aprobados con turno libre por fecha, idioma y hora.
+#
+# Los datos se leen en bloque con db_manager.obtener_datos_cobertura (un COPY de turnos y otro de
+# idiomas) y la matriz fecha x idioma x hora se calcula con NumPy, sin una consulta por combinación.
+# Un año con 10.000 guías se calcula en décimas de segundo (ver benchmark_cobertura.py).
+
+import csv
+import io
+from datetime import timedelta
+
+import numpy as np
+
+HORAS = 24
+
+
+def parsear_copy(texto, columnas):
+    """Convierte la salida de COPY (enteros separados por tabuladores) en un arreglo (filas, columnas)."""
+    if not texto:
+        return np.empty((0, columnas), dtype=np.int32)
+    return np.fromstring(texto, dtype=np.int32, sep=' ').reshape(-1, columnas)
+
+def calcular_cobertura(turnos, idiomas_guia, dias, idioma_ids):
+    """
+    turnos: arreglo (n, 4) con indice_guia, dia, hora_inicio, hora_fin.
+    idiomas_guia: arreglo (m, 2) con indice_guia, idioma_id.
+    Devuelve un arreglo (dias, len(idioma_ids), 24): guías disponibles en cada hora.
+    Un turno cuenta en la hora h si se superpone con [h, h+1); hora_fin <= hora_inicio se
+    interpreta como "hasta medianoche".
+    """
+    n_idiomas = len(idioma_ids)
+    cobertura = np.zeros((dias, n_idiomas, HORAS), dtype=np.int32)
+    if not len(turnos) or not len(idiomas_guia) or not n_idiomas:
+        return cobertura
+
+    # idioma_id -> columna de la matriz (los idiomas fuera del catálogo se descartan)
+    columna_de = np.full(max(max(idioma_ids), int(idiomas_guia[:, 1].max())) + 1, -1, dtype=np.int32)
+    columna_de[np.asarray(idioma_ids)] = np.arange(n_idiomas, dtype=np.int32)
+    columnas = columna_de[idiomas_guia[:, 1]]
+    validos = columnas >= 0
+    guias, columnas = idiomas_guia[validos, 0], columnas[validos]
+
+    # Idiomas agrupados por guía (formato CSR): los de la guía g están en
+    # columnas[inicio_guia[g]:inicio_guia[g] + cantidad[g]]
+    orden = np.argsort(guias, kind='stable')
+    columnas = columnas[orden]
+    n_guias = int(max(guias.max(initial=-1), turnos[:, 0].max())) + 1
+    cantidad = np.bincount(guias, minlength=n_guias).astype(np.int32)
+    inicio_guia = np.concatenate(([0], np.cumsum(cantidad)[:-1])).astype(np.int32)
+
+    # Repetir cada turno una vez por idioma de su guía
+    repeticiones = cantidad[turnos[:, 0]]
+    fila = np.repeat(np.arange(len(turnos), dtype=np.int32), repeticiones)
+    desplazamiento = np.arange(len(fila), dtype=np.int32) - np.repeat(np.cumsum(repeticiones) - repeticiones, repeticiones)
+    columna = columnas[inicio_guia[turnos[fila, 0]] + desplazamiento]
+
+    dia = turnos[fila, 1]
+    inicio = np.clip(turnos[fila, 2], 0, HORAS)
+    fin = turnos[fila, 3]
+    fin = np.where(fin <= inicio, HORAS, np.minimum(fin, HORAS))
+
+    # Arreglo de diferencias por hora (+1 al empezar, -1 al terminar) y suma acumulada
+    ancho = HORAS + 1
+    base = (dia * n_idiomas + columna) * ancho
+    total = dias * n_idiomas * ancho
+    diferencias = np.bincount(base + inicio, minlength=total) - np.bincount(base + fin, minlength=total)
+    cobertura[:] = np.cumsum(diferencias.reshape(dias, n_idiomas, ancho), axis=2)[:, :, :HORAS]
+    return cobertura
+
+def generar_reporte(desde, dias, idiomas):
+    """
+    idiomas: catálogo [(id, nombre), ...]. Devuelve un dict con 'fechas', 'idiomas' y
+    'cobertura' (arreglo dias x idiomas x 24), o None si falla la lectura.
+    """
+    from db_manager import obtener_datos_cobertura
+
+    datos = obtener_datos_cobertura(desde, desde + timedelta(days=dias - 1))
+    if datos is None:
+        return None
+    turnos = parsear_copy(datos[0], 4)
+    idiomas_guia = parsear_copy(datos[1], 2)
+    return {
+        'fechas': [desde + timedelta(days=i) for i in range(dias)],
+        'idiomas': idiomas,
+        'cobertura': calcular_cobertura(turnos, idiomas_guia, dias, [i[0] for i in idiomas]),
+    }
+
+def exportar_csv(reporte):
+    """Una fila por fecha e idioma, con una columna por hora (h00..h23)."""
+    salida = io.StringIO()
+    escritor = csv.writer(salida)
+    escritor.writerow(['fecha', 'idioma'] + [f"h{h:02d}" for h in range(HORAS)])
+    cobertura = reporte['cobertura'].tolist()
+    for i, fecha in enumerate(reporte['fechas']):
+        texto_fecha = fecha.isoformat()
+        for j, (_, nombre) in enumerate(reporte['idiomas']):
+            escritor.writerow([texto_fecha, nombre] + cobertura[i][j])
+    return salida.getvalue()
@@ -0,0 +1,112 @@
+# compresion.py - Compresión gzip/brotli de respuestas y recursos estáticos con huella (fingerprint).
+
+import gzip
+import hashlib
+import os
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # Dependencia opcional: sin ella solo se usa gzip
+    brotli = None
+
+COMPRESION_MIN_BYTES = int(os.environ.get('COMPRESION_MIN_BYTES', '1024'))
+COMPRESION_NIVEL_GZIP = 6
+COMPRESION_NIVEL_BROTLI = 5
+TIPOS_COMPRIMIBLES = {
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript',
+    'application/javascript', 'application/json', 'image/svg+xml',
+}
+CACHE_ESTATICOS_SEGUNDOS = 365 * 24 * 3600
+
+
+def comprimir(datos, codificacion):
+    if codificacion == 'br':
+        return brotli.compress(datos, quality=COMPRESION_NIVEL_BROTLI)
+    return gzip.compress(datos, compresslevel=COMPRESION_NIVEL_GZIP)
+
+def elegir_codificacion(accept_encoding):
+    """Devuelve 'br', 'gzip' o None según lo que acepte el cliente."""
+    aceptadas = set()
+    for parte in accept_encoding.split(','):
+        nombre, _, parametros = parte.partition(';')
+        calidad = 1.0
+        if parametros.strip().startswith('q='):
+            try:
+                calidad = float(parametros.strip()[2:])
+            except ValueError:
+                pass
+        if calidad > 0:
+            aceptadas.add(nombre.strip().lower())
+    if brotli is not None and 'br' in aceptadas:
+        return 'br'
+    if 'gzip' in aceptadas:
+        return 'gzip'
+    return None
+
+def comprimir_respuesta(response):
+    """after_request: comprime respuestas completas de tipo texto y tamaño suficiente."""
+    if request.endpoint == 'static' and response.status_code == 200:
+        # Los estáticos son pequeños (CSS): se leen en memoria para poder comprimirlos
+        response.direct_passthrough = False
+        response.make_sequence()
+
+    if (response.status_code != 200
+            or response.direct_passthrough      # Archivos enviados con send_file
+            or response.is_streamed             # Respuestas en streaming (p. ej. eventos SSE)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in TIPOS_COMPRIMIBLES):
+        return response
+
+    codificacion = elegir_codificacion(request.headers.get('Accept-Encoding', ''))
+    response.vary.add('Accept-Encoding')
+    if not codificacion:
+        return response
+
+    datos = response.get_data()
+    if len(datos) < COMPRESION_MIN_BYTES:
+        return response
+
+    response.set_data(comprimir(datos, codificacion))
+    response.headers['Content-Encoding'] = codificacion
+    if response.headers.get('ETag'):
+        # El ETag debe distinguir la versión comprimida de la original
+        response.set_etag(f"{response.get_etag()[0]}-{codificacion}")
+    return response
+
+# --------------------------------------------------------------------------
+# RECURSOS ESTÁTICOS CON HUELLA
+# --------------------------------------------------------------------------
+
+_huellas = {}
+
+def huella_estatico(app, filename):
+    """Hash corto del contenido del archivo estático (se calcula una vez por worker)."""
+    if filename not in _huellas:
+        ruta = os.path.join(app.static_folder, filename)
+        try:
+            with open(ruta, 'rb') as f:
+                _huellas[filename] = hashlib.md5(f.read()).hexdigest()[:10]
+        except OSError:
+            _huellas[filename] = None
+    return _huellas[filename]
+
+def configurar_compresion(app):
+    @app.url_defaults
+    def agregar_huella(endpoint, values):
+        # url_for('static', filename='css/base.css') -> /static/css/base.css?v=<hash>
+        if endpoint == 'static' and 'filename' in values and 'v' not in values:
+            huella = huella_estatico(app, values['filename'])
+            if huella:
+                values['v'] = huella
+
+    @app.after_request
+    def cabeceras_y_compresion(response):
+        # Con huella la URL cambia si cambia el contenido: se puede cachear "para siempre"
+        if request.endpoint == 'static' and request.args.get('v'):
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = CACHE_ESTATICOS_SEGUNDOS
+            response.cache_control.immutable = True
+        return comprimir_respuesta(response)
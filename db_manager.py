@@ -1,11 +1,19 @@
 # db_manager.py - Adaptado para PostgreSQL
 
+import io
 import os
+import time
+import itertools
+import contextvars
+import secrets
 import psycopg2
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from datetime import datetime, timedelta
 from psycopg2 import sql # Necesario para manejar identificadores y consultas dinámicas
+from psycopg2.extras import Json, execute_values # JSONB para la cola de trabajos y multi-insert eficiente
 from dotenv import load_dotenv # Opcional: para cargar DATABASE_URL localmente
+from cache import cache, invalidar_grupo
+from metricas import medir_funcion_db, DB_CONEXIONES_TOTAL, DB_CONEXIONES_ABIERTAS
 
 # Cargar variables de entorno si usas un archivo .env local
 # load_dotenv()
@@ -13,8 +21,111 @@ from dotenv import load_dotenv # Opcional: para cargar DATABASE_URL localmente
 ADMIN_LICENCIA = 'ADMIN001'
 ADMIN_PASSWORD_DEFAULT = 'admin123' 
 
-def get_db_connection():
-    """Establece la conexión con la base de datos PostgreSQL usando la URL de entorno."""
+# Segundos que una versión de autenticación (rol/aprobación) se mantiene en caché
+AUTH_CACHE_TTL = int(os.environ.get('AUTH_CACHE_TTL', '30'))
+
+# Expresión de texto completo sobre QUEJAS. Debe coincidir exactamente en el índice GIN y en buscar_quejas.
+# {t} es el prefijo de tabla opcional ('' en el índice, 'q.' en las consultas).
+_QUEJAS_TSVECTOR = "to_tsvector('spanish', {t}descripcion || ' ' || COALESCE({t}reportado_por, ''))"
+
+# Canales de LISTEN/NOTIFY para los cambios en vivo de disponibilidad (ver tiempo_real.py)
+CANAL_DISPONIBILIDAD = 'disponibilidad'   # payload: {"fechas": [...], "licencias": [...]} o {"todas": true}
+CANAL_GUIAS = 'guias'                     # payload: {"licencias": [...]} o {"todas": true}
+
+# Estados de queja que cuentan como "abiertas" en la analítica de quejas
+ESTADOS_QUEJA_ABIERTOS = ('pendiente', 'en revision')
+
+# --------------------------------------------------------------------------
+# RÉPLICAS DE LECTURA
+# --------------------------------------------------------------------------
+# DATABASE_REPLICA_URLS (opcional): URLs de réplicas separadas por comas. Las funciones de solo
+# lectura piden get_db_connection(solo_lectura=True) y se envían a una réplica sana; todo lo
+# demás va a la primaria. Tras una escritura, la petición (y la sesión, ver app.py) lee de la
+# primaria para ver sus propios cambios.
+
+DATABASE_REPLICA_URLS = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+REPLICA_PAUSA_SEGUNDOS = int(os.environ.get('REPLICA_PAUSA_SEGUNDOS', '30'))       # Tiempo fuera de rotación tras un fallo
+REPLICA_MAX_RETRASO_SEGUNDOS = float(os.environ.get('REPLICA_MAX_RETRASO', '10'))  # Retraso de replicación tolerado
+REPLICA_CHEQUEO_SEGUNDOS = 30                                                       # Cada cuánto se mide el retraso
+
+_estado_replicas = {url: {'fuera_hasta': 0, 'ultimo_chequeo': 0} for url in DATABASE_REPLICA_URLS}
+_turno_replica = itertools.count()
+_leer_de_primaria = contextvars.ContextVar('leer_de_primaria', default=False)
+_hubo_escritura = contextvars.ContextVar('hubo_escritura', default=False)
+
+class _ConexionMedida(psycopg2.extensions.connection):
+    """Conexión que lleva la cuenta de conexiones abiertas por destino (métricas)."""
+    destino = 'replica'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        DB_CONEXIONES_TOTAL.labels(self.destino).inc()
+        DB_CONEXIONES_ABIERTAS.labels(self.destino).inc()
+
+    def close(self):
+        if not self.closed:
+            DB_CONEXIONES_ABIERTAS.labels(self.destino).dec()
+        super().close()
+
+class _ConexionPrimaria(_ConexionMedida):
+    """Conexión a la primaria que registra si se confirmó alguna escritura (commit)."""
+    destino = 'primaria'
+
+    def commit(self):
+        super().commit()
+        _hubo_escritura.set(True)
+
+def iniciar_contexto_lectura(forzar_primaria=False):
+    """Se llama al inicio de cada petición: define si las lecturas deben ir a la primaria."""
+    _leer_de_primaria.set(forzar_primaria)
+    _hubo_escritura.set(False)
+
+def hubo_escritura():
+    return _hubo_escritura.get()
+
+def _retraso_replica(conn):
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                    ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 0) END
+    """)
+    return float(cursor.fetchone()[0] or 0)
+
+def _conectar_replica():
+    """Conecta a la siguiente réplica sana (round-robin). Devuelve None si no hay ninguna disponible."""
+    ahora = time.monotonic()
+    inicio = next(_turno_replica)
+    for i in range(len(DATABASE_REPLICA_URLS)):
+        url = DATABASE_REPLICA_URLS[(inicio + i) % len(DATABASE_REPLICA_URLS)]
+        estado = _estado_replicas[url]
+        if estado['fuera_hasta'] > ahora:
+            continue
+        conn = None
+        try:
+            conn = psycopg2.connect(url, connect_timeout=2, connection_factory=_ConexionMedida)
+            if ahora - estado['ultimo_chequeo'] >= REPLICA_CHEQUEO_SEGUNDOS:
+                estado['ultimo_chequeo'] = ahora
+                retraso = _retraso_replica(conn)
+                if retraso > REPLICA_MAX_RETRASO_SEGUNDOS:
+                    raise psycopg2.OperationalError(f"retraso de replicación de {retraso:.1f}s")
+                conn.rollback()
+            conn.set_session(readonly=True)
+            return conn
+        except psycopg2.Error as e:
+            print(f"Réplica fuera de rotación por {REPLICA_PAUSA_SEGUNDOS}s: {e}")
+            estado['fuera_hasta'] = ahora + REPLICA_PAUSA_SEGUNDOS
+            if conn: conn.close()
+    return None
+
+def get_db_connection(solo_lectura=False):
+    """Establece la conexión con la base de datos PostgreSQL usando la URL de entorno.
+
+    Con solo_lectura=True la conexión puede ir a una réplica (ver DATABASE_REPLICA_URLS).
+    """
+    if solo_lectura and DATABASE_REPLICA_URLS and not _leer_de_primaria.get() and not _hubo_escritura.get():
+        conn = _conectar_replica()
+        if conn:
+            return conn
     
     # Render, Railway o cualquier hosting proporcionará esta variable.
     # Para pruebas locales, defínela manualmente o usa dotenv.
@@ -25,7 +136,7 @@ def get_db_connection():
         raise Exception("Error de configuración: La variable de entorno 'DATABASE_URL' no está definida.")
         
     try:
-        conn = psycopg2.connect(DATABASE_URL)
+        conn = psycopg2.connect(DATABASE_URL, connection_factory=_ConexionPrimaria)
         return conn
     except Exception as e:
         print(f"Error al conectar con PostgreSQL: {e}")
@@ -58,6 +169,9 @@ def inicializar_db():
             );
         """)
     
+        # Versión de autenticación: se incrementa al cambiar rol o aprobación para invalidar sesiones
+        cursor.execute("ALTER TABLE GUIAS ADD COLUMN IF NOT EXISTS auth_version INTEGER NOT NULL DEFAULT 1;")
+
         # Tabla IDIOMAS
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS IDIOMAS (
@@ -103,6 +217,134 @@ def inicializar_db():
             );
         """)
 
+        # Índices de QUEJAS para el filtrado de gestion_quejas (ver buscar_quejas)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_quejas_estado_fecha ON QUEJAS (estado, fecha_queja DESC);")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_quejas_guia_fecha ON QUEJAS (licencia_guia, fecha_queja DESC);")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_quejas_fecha ON QUEJAS (fecha_queja DESC);")
+        cursor.execute(f"""
+            CREATE INDEX IF NOT EXISTS idx_quejas_texto ON QUEJAS USING GIN ({_QUEJAS_TSVECTOR.format(t='')});
+        """)
+
+        # Tablas de resumen de QUEJAS (mantenidas por registrar_queja, actualizar_estado_queja,
+        # eliminar_queja_db y la eliminación de guías; recalcular_resumen_quejas las reconstruye)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS QUEJAS_RESUMEN_GUIA (
+                licencia_guia VARCHAR(10) PRIMARY KEY,
+                total INTEGER NOT NULL DEFAULT 0,
+                abiertas INTEGER NOT NULL DEFAULT 0,
+                FOREIGN KEY (licencia_guia) REFERENCES GUIAS (licencia) ON DELETE CASCADE
+            );
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_quejas_resumen_abiertas ON QUEJAS_RESUMEN_GUIA (abiertas DESC);")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS QUEJAS_RESUMEN_SEMANA (
+                semana DATE NOT NULL,
+                estado VARCHAR(50) NOT NULL,
+                total INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (semana, estado)
+            );
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS QUEJAS_RESUMEN_ESTADO (
+                estado VARCHAR(50) PRIMARY KEY,
+                total INTEGER NOT NULL DEFAULT 0
+            );
+        """)
+
+        # Índice por fecha: acelera la búsqueda por fecha y el archivado de fechas pasadas
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_disponibilidad_fecha ON DISPONIBILIDAD_FECHAS (fecha);")
+
+        # Tabla DISPONIBILIDAD_HISTORICO (fechas pasadas, particionada por mes; ver archivar_disponibilidad_pasada)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS DISPONIBILIDAD_HISTORICO (
+                id INTEGER NOT NULL,
+                licencia_guia VARCHAR(10) NOT NULL,
+                fecha DATE NOT NULL,
+                hora_inicio TIME NOT NULL,
+                hora_fin TIME NOT NULL,
+                fecha_archivado TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+            ) PARTITION BY RANGE (fecha);
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_disponibilidad_historico_guia
+            ON DISPONIBILIDAD_HISTORICO (licencia_guia, fecha);
+        """)
+
+        # Tabla RESERVAS (ver sección 9). Copia fecha y horario para conservar el historial cuando
+        # la disponibilidad se archiva (ON DELETE SET NULL).
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS RESERVAS (
+                id SERIAL PRIMARY KEY,
+                codigo VARCHAR(32) NOT NULL UNIQUE,
+                disponibilidad_id INTEGER REFERENCES DISPONIBILIDAD_FECHAS (id) ON DELETE SET NULL,
+                licencia_guia VARCHAR(10) NOT NULL,
+                fecha DATE NOT NULL,
+                hora_inicio TIME NOT NULL,
+                hora_fin TIME NOT NULL,
+                cliente_nombre VARCHAR(255) NOT NULL,
+                cliente_contacto VARCHAR(255) NOT NULL,
+                estado VARCHAR(20) NOT NULL DEFAULT 'retenida',
+                retenida_hasta TIMESTAMP WITH TIME ZONE,
+                fecha_creacion TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                fecha_confirmacion TIMESTAMP WITH TIME ZONE,
+                fecha_cancelacion TIMESTAMP WITH TIME ZONE,
+                FOREIGN KEY (licencia_guia) REFERENCES GUIAS (licencia) ON DELETE CASCADE
+            );
+        """)
+        # Garantía de la base de datos contra la doble reserva: una sola reserva activa por turno
+        cursor.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_reservas_turno_activo
+            ON RESERVAS (disponibilidad_id) WHERE estado IN ('retenida', 'confirmada');
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_reservas_guia_fecha ON RESERVAS (licencia_guia, fecha DESC);")
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_reservas_retenidas
+            ON RESERVAS (retenida_hasta) WHERE estado = 'retenida';
+        """)
+
+        # Tabla TRABAJOS (cola de trabajos en segundo plano, ver worker.py)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS TRABAJOS (
+                id BIGSERIAL PRIMARY KEY,
+                tipo VARCHAR(100) NOT NULL,
+                payload JSONB NOT NULL DEFAULT '{}',
+                estado VARCHAR(20) NOT NULL DEFAULT 'pendiente',
+                prioridad INTEGER NOT NULL DEFAULT 100,
+                intentos INTEGER NOT NULL DEFAULT 0,
+                max_intentos INTEGER NOT NULL DEFAULT 3,
+                ejecutar_despues TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                bloqueado_hasta TIMESTAMP WITH TIME ZONE,
+                bloqueado_por VARCHAR(100),
+                resultado JSONB,
+                ultimo_error TEXT,
+                creado_por VARCHAR(10),
+                fecha_creacion TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                fecha_inicio TIMESTAMP WITH TIME ZONE,
+                fecha_fin TIMESTAMP WITH TIME ZONE
+            );
+        """)
+        # Índice parcial: el worker solo busca trabajos pendientes o en proceso
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_trabajos_cola
+            ON TRABAJOS (prioridad, id) WHERE estado IN ('pendiente', 'en_proceso');
+        """)
+
+        # Tabla CACHE_VERSIONES: versión de cada grupo de caché (ver cache.version_grupo).
+        # La incrementan los triggers de _crear_triggers_cache en la misma transacción que
+        # modifica los datos, así todos los procesos ven la invalidación.
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS CACHE_VERSIONES (
+                grupo VARCHAR(30) PRIMARY KEY,
+                version BIGINT NOT NULL DEFAULT 0
+            );
+        """)
+        cursor.execute("""
+            INSERT INTO CACHE_VERSIONES (grupo) VALUES ('guias'), ('idiomas') ON CONFLICT (grupo) DO NOTHING;
+        """)
+
+        _crear_triggers_cache(cursor)
+        _crear_triggers_notificacion(cursor)
+
         # Asegurar Administrador Principal
         admin_password_hash = generate_password_hash(ADMIN_PASSWORD_DEFAULT)
         cursor.execute("SELECT COUNT(*) FROM GUIAS WHERE licencia = %s", (ADMIN_LICENCIA,))
@@ -121,6 +363,128 @@ def inicializar_db():
         if conn:
             conn.close()
 
+def _crear_triggers_cache(cursor):
+    """Triggers por sentencia que incrementan la versión de los grupos de caché afectados."""
+    cursor.execute("""
+        CREATE OR REPLACE FUNCTION incrementar_version_cache() RETURNS trigger AS $$
+        BEGIN
+            UPDATE CACHE_VERSIONES SET version = version + 1 WHERE grupo = ANY(TG_ARGV);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    # Renombrar o eliminar un idioma también cambia los idiomas mostrados de cada guía
+    tablas = (('GUIAS', "'guias'"), ('GUIA_IDIOMAS', "'guias'"), ('IDIOMAS', "'idiomas', 'guias'"))
+    for tabla, grupos in tablas:
+        nombre = f"trg_{tabla.lower()}_version_cache"
+        cursor.execute(f"""
+            DO $$ BEGIN
+                IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = '{nombre}') THEN
+                    CREATE TRIGGER {nombre} AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {tabla}
+                    FOR EACH STATEMENT EXECUTE FUNCTION incrementar_version_cache({grupos});
+                END IF;
+            END $$;
+        """)
+
+def _crear_triggers_notificacion(cursor):
+    """
+    Triggers por sentencia (con tablas de transición) que publican con pg_notify qué fechas y
+    guías cambiaron. Una carga masiva genera una sola notificación; las filas pasadas se ignoran.
+    Si el payload no cabe en el límite de NOTIFY (8000 bytes) se envía {"todas": true}.
+    """
+    cursor.execute(f"""
+        CREATE OR REPLACE FUNCTION notificar_disponibilidad() RETURNS trigger AS $$
+        DECLARE
+            payload TEXT;
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                SELECT json_build_object('fechas', json_agg(DISTINCT fecha), 'licencias', json_agg(DISTINCT licencia_guia))::text
+                INTO payload FROM nuevos WHERE fecha >= CURRENT_DATE HAVING COUNT(*) > 0;
+            ELSIF TG_OP = 'DELETE' THEN
+                SELECT json_build_object('fechas', json_agg(DISTINCT fecha), 'licencias', json_agg(DISTINCT licencia_guia))::text
+                INTO payload FROM viejos WHERE fecha >= CURRENT_DATE HAVING COUNT(*) > 0;
+            ELSE
+                SELECT json_build_object('fechas', json_agg(DISTINCT fecha), 'licencias', json_agg(DISTINCT licencia_guia))::text
+                INTO payload
+                FROM (SELECT fecha, licencia_guia FROM nuevos UNION SELECT fecha, licencia_guia FROM viejos) f
+                WHERE fecha >= CURRENT_DATE HAVING COUNT(*) > 0;
+            END IF;
+            IF payload IS NOT NULL THEN
+                IF octet_length(payload) > 7900 THEN
+                    payload := '{{"todas": true}}';
+                END IF;
+                PERFORM pg_notify('{CANAL_DISPONIBILIDAD}', payload);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    # Solo interesan los guías que aparecen en la búsqueda (aprobados): un registro pendiente de
+    # aprobación o un cambio de contraseña, teléfono o auth_version no publica nada. En GUIAS,
+    # un cambio de aprobación o de nombre, email o bio; en GUIA_IDIOMAS, los de guías aprobados.
+    # Los triggers existentes usan siempre la última versión de la función (CREATE OR REPLACE).
+    cursor.execute(f"""
+        CREATE OR REPLACE FUNCTION notificar_guias() RETURNS trigger AS $$
+        DECLARE
+            payload TEXT;
+        BEGIN
+            IF TG_TABLE_NAME = 'guias' AND TG_OP = 'INSERT' THEN
+                SELECT json_build_object('licencias', json_agg(licencia))::text
+                INTO payload FROM nuevos WHERE aprobado = 1 HAVING COUNT(*) > 0;
+            ELSIF TG_TABLE_NAME = 'guias' AND TG_OP = 'DELETE' THEN
+                SELECT json_build_object('licencias', json_agg(licencia))::text
+                INTO payload FROM viejos WHERE aprobado = 1 HAVING COUNT(*) > 0;
+            ELSIF TG_TABLE_NAME = 'guias' THEN
+                SELECT json_build_object('licencias', json_agg(n.licencia))::text
+                INTO payload
+                FROM nuevos n JOIN viejos v ON v.licencia = n.licencia
+                WHERE n.aprobado IS DISTINCT FROM v.aprobado
+                   OR (n.aprobado = 1 AND (n.nombre, n.email, n.bio) IS DISTINCT FROM (v.nombre, v.email, v.bio))
+                HAVING COUNT(*) > 0;
+            ELSIF TG_OP = 'INSERT' THEN
+                SELECT json_build_object('licencias', json_agg(DISTINCT f.licencia))::text
+                INTO payload FROM nuevos f JOIN GUIAS G ON G.licencia = f.licencia AND G.aprobado = 1
+                HAVING COUNT(*) > 0;
+            ELSIF TG_OP = 'DELETE' THEN
+                SELECT json_build_object('licencias', json_agg(DISTINCT f.licencia))::text
+                INTO payload FROM viejos f JOIN GUIAS G ON G.licencia = f.licencia AND G.aprobado = 1
+                HAVING COUNT(*) > 0;
+            ELSE
+                SELECT json_build_object('licencias', json_agg(DISTINCT f.licencia))::text
+                INTO payload
+                FROM (SELECT licencia FROM nuevos UNION SELECT licencia FROM viejos) f
+                JOIN GUIAS G ON G.licencia = f.licencia AND G.aprobado = 1
+                HAVING COUNT(*) > 0;
+            END IF;
+            IF payload IS NOT NULL THEN
+                IF octet_length(payload) > 7900 THEN
+                    payload := '{{"todas": true}}';
+                END IF;
+                PERFORM pg_notify('{CANAL_GUIAS}', payload);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    tablas = (('DISPONIBILIDAD_FECHAS', 'notificar_disponibilidad'), ('RESERVAS', 'notificar_disponibilidad'),
+              ('GUIAS', 'notificar_guias'), ('GUIA_IDIOMAS', 'notificar_guias'))
+    transiciones = (('INSERT', 'NEW TABLE AS nuevos'), ('UPDATE', 'NEW TABLE AS nuevos OLD TABLE AS viejos'),
+                    ('DELETE', 'OLD TABLE AS viejos'))
+    for tabla, funcion in tablas:
+        for evento, referencias in transiciones:
+            nombre = f"trg_{tabla.lower()}_{evento.lower()}_notificar"
+            # Solo se crea si no existe: evita tomar un lock exclusivo en cada arranque
+            cursor.execute(f"""
+                DO $$ BEGIN
+                    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = '{nombre}') THEN
+                        CREATE TRIGGER {nombre} AFTER {evento} ON {tabla}
+                        REFERENCING {referencias}
+                        FOR EACH STATEMENT EXECUTE FUNCTION {funcion}();
+                    END IF;
+                END $$;
+            """)
+
 # --------------------------------------------------------------------------
 # 2. FUNCIONES DE REGISTRO Y LOGIN (Cambio de ? a %s)
 # --------------------------------------------------------------------------
@@ -133,6 +497,7 @@ def registrar_guia(licencia, nombre, password):
         cursor.execute("INSERT INTO GUIAS (licencia, nombre, password, rol, aprobado) VALUES (%s, %s, %s, 'guia', 0)", 
                        (licencia, nombre, password_hash))
         conn.commit()
+        invalidar_grupo('guias')
         return True
     except psycopg2.IntegrityError:
         return False
@@ -145,7 +510,7 @@ def get_guia_data(licencia, all_data=False):
     conn = get_db_connection()
     try:
         cursor = conn.cursor()
-        query = "SELECT * FROM GUIAS WHERE licencia = %s" if all_data else "SELECT password, rol, aprobado FROM GUIAS WHERE licencia = %s"
+        query = "SELECT * FROM GUIAS WHERE licencia = %s" if all_data else "SELECT password, rol, aprobado, auth_version FROM GUIAS WHERE licencia = %s"
         cursor.execute(query, (licencia,)) 
         data = cursor.fetchone()
         return data
@@ -154,12 +519,55 @@ def get_guia_data(licencia, all_data=False):
     finally:
         if conn: conn.close()
 
+def _clave_auth(licencia):
+    return f"auth:{licencia}"
+
+def invalidar_cache_auth(*licencias):
+    cache.delete(*[_clave_auth(licencia) for licencia in licencias])
+
+def obtener_estado_auth(licencia):
+    """
+    Devuelve (auth_version, rol, aprobado) del guía, o None si ya no existe.
+    Se consulta primero la caché (TTL corto) y solo ante un fallo se va a la base de datos.
+    Los errores de base de datos se propagan para que el llamador decida qué hacer.
+    """
+    clave = _clave_auth(licencia)
+    estado = cache.get(clave)
+    if estado is not None:
+        return tuple(estado) if estado else None
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT auth_version, rol, aprobado FROM GUIAS WHERE licencia = %s", (licencia,))
+        row = cursor.fetchone()
+    finally:
+        if conn: conn.close()
+
+    # Una lista vacía marca "el guía no existe" (None significa "no está en caché")
+    cache.set(clave, list(row) if row else [], AUTH_CACHE_TTL)
+    return tuple(row) if row else None
+
+def obtener_versiones_cache():
+    """Devuelve {grupo: versión} de CACHE_VERSIONES (siempre de la primaria), o None si falla."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT grupo, version FROM CACHE_VERSIONES")
+        return dict(cursor.fetchall())
+    except Exception as e:
+        print(f"Error al leer las versiones de caché: {e}")
+        return None
+    finally:
+        if conn: conn.close()
+
 # --------------------------------------------------------------------------
 # 3. FUNCIONES DE ADMINISTRACIÓN (CRUD Guías)
 # --------------------------------------------------------------------------
 
 def obtener_todos_los_guias():
-    conn = get_db_connection()
+    conn = get_db_connection(solo_lectura=True)
     try:
         cursor = conn.cursor()
         cursor.execute("SELECT licencia, nombre, rol, aprobado, fecha_registro, telefono, email FROM GUIAS ORDER BY fecha_registro DESC")
@@ -174,8 +582,10 @@ def cambiar_aprobacion(licencia, estado):
     conn = get_db_connection()
     try:
         cursor = conn.cursor()
-        cursor.execute("UPDATE GUIAS SET aprobado = %s WHERE licencia = %s", (estado, licencia))
+        cursor.execute("UPDATE GUIAS SET aprobado = %s, auth_version = auth_version + 1 WHERE licencia = %s", (estado, licencia))
         conn.commit()
+        invalidar_grupo('guias')
+        invalidar_cache_auth(licencia)
         return cursor.rowcount > 0
     except psycopg2.Error:
         return False
@@ -186,8 +596,11 @@ def eliminar_guia(licencia):
     conn = get_db_connection()
     try:
         cursor = conn.cursor()
+        _descontar_quejas_de_guias(cursor, [licencia])
         cursor.execute("DELETE FROM GUIAS WHERE licencia = %s", (licencia,))
         conn.commit()
+        invalidar_grupo('guias')
+        invalidar_cache_auth(licencia)
         return cursor.rowcount > 0
     except psycopg2.Error:
         return False
@@ -198,8 +611,10 @@ def promover_a_admin(licencia):
     conn = get_db_connection()
     try:
         cursor = conn.cursor()
-        cursor.execute("UPDATE GUIAS SET rol = 'admin' WHERE licencia = %s AND rol != 'admin'", (licencia,))
+        cursor.execute("UPDATE GUIAS SET rol = 'admin', auth_version = auth_version + 1 WHERE licencia = %s AND rol != 'admin'", (licencia,))
         conn.commit()
+        invalidar_grupo('guias')
+        invalidar_cache_auth(licencia)
         return cursor.rowcount > 0
     except psycopg2.Error:
         return False
@@ -212,14 +627,75 @@ def degradar_a_guia(licencia):
         cursor = conn.cursor()
         if licencia == ADMIN_LICENCIA:
             return False 
-        cursor.execute("UPDATE GUIAS SET rol = 'guia' WHERE licencia = %s AND rol = 'admin'", (licencia,))
+        cursor.execute("UPDATE GUIAS SET rol = 'guia', auth_version = auth_version + 1 WHERE licencia = %s AND rol = 'admin'", (licencia,))
         conn.commit()
+        invalidar_grupo('guias')
+        invalidar_cache_auth(licencia)
         return cursor.rowcount > 0
     except psycopg2.Error:
         return False
     finally:
         if conn: conn.close()
 
+# --- Acciones masivas (una sola sentencia por lote) ---
+
+def _resultado_por_licencia(licencias, afectadas):
+    """Devuelve {licencia: True/False} según si la licencia fue afectada por la sentencia."""
+    afectadas = set(afectadas)
+    return {licencia: licencia in afectadas for licencia in licencias}
+
+def _ejecutar_masivo(query, params, licencias, previo=None):
+    """
+    Ejecuta una sentencia con 'licencia = ANY(%s)' ... RETURNING licencia y reporta el resultado por licencia.
+    previo(cursor, licencias) se ejecuta antes, dentro de la misma transacción.
+    """
+    licencias = list(dict.fromkeys(licencias))  # Quitar duplicados conservando el orden
+    if not licencias:
+        return {}
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        if previo:
+            previo(cursor, licencias)
+        cursor.execute(query, params + (licencias,))
+        afectadas = [row[0] for row in cursor.fetchall()]
+        conn.commit()
+        if afectadas:
+            invalidar_grupo('guias')
+            invalidar_cache_auth(*afectadas)
+        return _resultado_por_licencia(licencias, afectadas)
+    except psycopg2.Error:
+        if conn: conn.rollback()
+        return {licencia: False for licencia in licencias}
+    finally:
+        if conn: conn.close()
+
+def cambiar_aprobacion_masiva(licencias, estado):
+    return _ejecutar_masivo(
+        # Solo los que cambian de estado: volver a aprobar a un aprobado no debe cerrar su sesión
+        "UPDATE GUIAS SET aprobado = %s, auth_version = auth_version + 1 WHERE aprobado <> %s AND licencia = ANY(%s) RETURNING licencia",
+        (estado, estado), licencias)
+
+def eliminar_guias_masivo(licencias):
+    # El administrador principal nunca se elimina desde una acción masiva.
+    return _ejecutar_masivo(
+        "DELETE FROM GUIAS WHERE licencia != %s AND licencia = ANY(%s) RETURNING licencia",
+        (ADMIN_LICENCIA,), licencias,
+        previo=lambda cursor, ls: _descontar_quejas_de_guias(cursor, [l for l in ls if l != ADMIN_LICENCIA]))
+
+def cambiar_rol_masivo(licencias, nuevo_rol):
+    if nuevo_rol == 'admin':
+        return _ejecutar_masivo(
+            "UPDATE GUIAS SET rol = 'admin', auth_version = auth_version + 1 WHERE rol != 'admin' AND licencia = ANY(%s) RETURNING licencia",
+            (), licencias)
+    if nuevo_rol == 'guia':
+        # Misma protección que degradar_a_guia: ADMIN_LICENCIA no puede ser degradado.
+        return _ejecutar_masivo(
+            "UPDATE GUIAS SET rol = 'guia', auth_version = auth_version + 1 WHERE rol = 'admin' AND licencia != %s AND licencia = ANY(%s) RETURNING licencia",
+            (ADMIN_LICENCIA,), licencias)
+    return {licencia: False for licencia in licencias}
+
 # --------------------------------------------------------------------------
 # 4. FUNCIONES DE IDIOMAS (ADMIN/GUÍA)
 # --------------------------------------------------------------------------
@@ -230,6 +706,7 @@ def agregar_idioma_db(nombre_idioma):
         cursor = conn.cursor()
         cursor.execute("INSERT INTO IDIOMAS (nombre) VALUES (%s)", (nombre_idioma,))
         conn.commit()
+        invalidar_grupo('idiomas')
         return True
     except psycopg2.IntegrityError:
         return False
@@ -239,7 +716,7 @@ def agregar_idioma_db(nombre_idioma):
         if conn: conn.close()
 
 def obtener_todos_los_idiomas():
-    conn = get_db_connection()
+    conn = get_db_connection(solo_lectura=True)
     try:
         cursor = conn.cursor()
         cursor.execute("SELECT id, nombre FROM IDIOMAS ORDER BY nombre ASC")
@@ -256,6 +733,7 @@ def actualizar_idioma_db(idioma_id, nuevo_nombre):
         cursor = conn.cursor()
         cursor.execute("UPDATE IDIOMAS SET nombre = %s WHERE id = %s", (nuevo_nombre, idioma_id))
         conn.commit()
+        invalidar_grupo('idiomas', 'guias')
         return cursor.rowcount > 0
     except psycopg2.IntegrityError:
         return False
@@ -270,6 +748,7 @@ def eliminar_idioma_db(idioma_id):
         cursor = conn.cursor()
         cursor.execute("DELETE FROM IDIOMAS WHERE id = %s", (idioma_id,))
         conn.commit()
+        invalidar_grupo('idiomas', 'guias')
         return cursor.rowcount > 0
     except psycopg2.Error:
         return False
@@ -277,7 +756,7 @@ def eliminar_idioma_db(idioma_id):
         if conn: conn.close()
 
 def obtener_idiomas_de_guia(licencia):
-    conn = get_db_connection()
+    conn = get_db_connection(solo_lectura=True)
     try:
         cursor = conn.cursor()
         cursor.execute("SELECT idioma_id FROM GUIA_IDIOMAS WHERE licencia = %s", (licencia,))
@@ -304,6 +783,7 @@ def actualizar_idiomas_de_guia(licencia, idioma_ids):
             cursor.executemany(insert_query, data)
 
         conn.commit()
+        invalidar_grupo('guias')
         return True
     except psycopg2.Error:
         if conn: conn.rollback()
@@ -311,15 +791,16 @@ def actualizar_idiomas_de_guia(licencia, idioma_ids):
     finally:
         if conn: conn.close()
 
-def obtener_idiomas_de_multiples_guias(licencias):
+def obtener_idiomas_de_multiples_guias(licencias, propagar_errores=False):
     """
     Obtiene los nombres de los idiomas dominados para una lista de licencias de guías.
     Devuelve un diccionario: {licencia: 'Idioma1, Idioma2, ...'}
+    Con propagar_errores=True un error de base de datos se propaga en lugar de devolver {}.
     """
     if not licencias:
         return {}
         
-    conn = get_db_connection()
+    conn = get_db_connection(solo_lectura=True)
     try:
         cursor = conn.cursor()
         
@@ -342,6 +823,8 @@ def obtener_idiomas_de_multiples_guias(licencias):
         idiomas_por_guia = {row[0]: row[1] for row in cursor.fetchall()}
         return idiomas_por_guia
     except psycopg2.Error:
+        if propagar_errores:
+            raise
         return {}
     finally:
         if conn: conn.close()
@@ -371,6 +854,7 @@ def actualizar_perfil_db(licencia, nuevo_nombre, nuevo_telefono, nuevo_email, nu
         cursor.execute("UPDATE GUIAS SET nombre = %s, telefono = %s, email = %s, bio = %s WHERE licencia = %s", 
                        (nuevo_nombre, nuevo_telefono, nuevo_email, nueva_bio, licencia))
         conn.commit()
+        invalidar_grupo('guias')
         return cursor.rowcount > 0
     except psycopg2.Error:
         return False
@@ -381,12 +865,68 @@ def actualizar_perfil_db(licencia, nuevo_nombre, nuevo_telefono, nuevo_email, nu
 # 6. FUNCIONES DE GESTIÓN DE QUEJAS
 # --------------------------------------------------------------------------
 
+def _ajustar_resumen_quejas(cursor, licencia_guia, fecha_queja, deltas):
+    """
+    Aplica deltas {estado: +1/-1} de una queja a las tablas de resumen, en la transacción del cursor.
+    Cada tabla se actualiza con un solo upsert y las filas van ordenadas por estado: dos
+    transiciones opuestas concurrentes bloquean las filas en el mismo orden y no se interbloquean.
+    """
+    deltas = sorted((estado, delta) for estado, delta in deltas.items() if delta)
+    if not deltas:
+        return
+    total = sum(delta for _, delta in deltas)
+    abiertas = sum(delta for estado, delta in deltas if estado in ESTADOS_QUEJA_ABIERTOS)
+    cursor.execute("""
+        INSERT INTO QUEJAS_RESUMEN_GUIA (licencia_guia, total, abiertas) VALUES (%s, %s, %s)
+        ON CONFLICT (licencia_guia) DO UPDATE
+        SET total = QUEJAS_RESUMEN_GUIA.total + EXCLUDED.total,
+            abiertas = QUEJAS_RESUMEN_GUIA.abiertas + EXCLUDED.abiertas
+    """, (licencia_guia, total, abiertas))
+    execute_values(cursor, """
+        INSERT INTO QUEJAS_RESUMEN_SEMANA (semana, estado, total) VALUES %s
+        ON CONFLICT (semana, estado) DO UPDATE SET total = QUEJAS_RESUMEN_SEMANA.total + EXCLUDED.total
+    """, [(fecha_queja, estado, delta) for estado, delta in deltas],
+        template="(DATE_TRUNC('week', %s::timestamptz)::date, %s, %s)")
+    execute_values(cursor, """
+        INSERT INTO QUEJAS_RESUMEN_ESTADO (estado, total) VALUES %s
+        ON CONFLICT (estado) DO UPDATE SET total = QUEJAS_RESUMEN_ESTADO.total + EXCLUDED.total
+    """, deltas)
+
+def _descontar_quejas_de_guias(cursor, licencias):
+    """
+    Antes de borrar guías (sus quejas se eliminan en cascada) descuenta sus quejas de los
+    resúmenes por semana y por estado. QUEJAS_RESUMEN_GUIA se limpia sola por ON DELETE CASCADE.
+    """
+    if not licencias:
+        return
+    cursor.execute("""
+        UPDATE QUEJAS_RESUMEN_SEMANA r SET total = r.total - x.n
+        FROM (
+            SELECT DATE_TRUNC('week', fecha_queja)::date AS semana, estado, COUNT(*) AS n
+            FROM QUEJAS WHERE licencia_guia = ANY(%s)
+            GROUP BY 1, 2
+        ) x
+        WHERE r.semana = x.semana AND r.estado = x.estado
+    """, (list(licencias),))
+    cursor.execute("""
+        UPDATE QUEJAS_RESUMEN_ESTADO r SET total = r.total - x.n
+        FROM (
+            SELECT estado, COUNT(*) AS n FROM QUEJAS WHERE licencia_guia = ANY(%s) GROUP BY estado
+        ) x
+        WHERE r.estado = x.estado
+    """, (list(licencias),))
+
 def registrar_queja(licencia_guia, descripcion, reportado_por=None):
     conn = get_db_connection()
     try:
         cursor = conn.cursor()
-        cursor.execute("INSERT INTO QUEJAS (licencia_guia, descripcion, reportado_por, estado) VALUES (%s, %s, %s, 'pendiente')", 
-                       (licencia_guia, descripcion, reportado_por))
+        cursor.execute("""
+            INSERT INTO QUEJAS (licencia_guia, descripcion, reportado_por, estado)
+            VALUES (%s, %s, %s, 'pendiente')
+            RETURNING fecha_queja
+        """, (licencia_guia, descripcion, reportado_por))
+        fecha_queja = cursor.fetchone()[0]
+        _ajustar_resumen_quejas(cursor, licencia_guia, fecha_queja, {'pendiente': 1})
         conn.commit()
         return True
     except psycopg2.IntegrityError:
@@ -397,7 +937,7 @@ def registrar_queja(licencia_guia, descripcion, reportado_por=None):
         if conn: conn.close()
 
 def obtener_todas_las_quejas():
-    conn = get_db_connection()
+    conn = get_db_connection(solo_lectura=True)
     try:
         cursor = conn.cursor()
         cursor.execute("""
@@ -413,7 +953,7 @@ def obtener_todas_las_quejas():
         if conn: conn.close()
 
 def obtener_todas_las_quejas_para_guias():
-    conn = get_db_connection()
+    conn = get_db_connection(solo_lectura=True)
     try:
         cursor = conn.cursor()
         cursor.execute("""
@@ -437,13 +977,92 @@ def obtener_todas_las_quejas_para_guias():
         if conn: conn.close()
 
 
+# Conteo máximo de coincidencias para los filtros que no tienen un total precalculado
+QUEJAS_CONTEO_MAXIMO = 10000
+
+def buscar_quejas(estado=None, licencia_guia=None, desde=None, hasta=None, texto=None, pagina=1, por_pagina=50):
+    """
+    Filtra QUEJAS por estado, guía, rango de fechas (inclusive) y texto libre en descripcion/reportado_por.
+    Devuelve (quejas, total, pagina, es_minimo): las filas de la página pedida, en el mismo
+    formato que obtener_todas_las_quejas_para_guias, el total de coincidencias, la página
+    efectiva y si el total es solo una cota inferior.
+    Sin filtros, o solo por estado, el total exacto sale de QUEJAS_RESUMEN_ESTADO; con otros
+    filtros se cuenta hasta QUEJAS_CONTEO_MAXIMO y, si se alcanza, es_minimo es True.
+    Con un total exacto, una página posterior a la última se ajusta a la última; con un total
+    mínimo no se conoce la última página y la pedida se devuelve tal cual (quizás vacía).
+    """
+    condiciones = []
+    params = []
+    if estado:
+        condiciones.append("q.estado = %s")
+        params.append(estado)
+    if licencia_guia:
+        condiciones.append("q.licencia_guia = %s")
+        params.append(licencia_guia)
+    if desde:
+        condiciones.append("q.fecha_queja >= %s")
+        params.append(desde)
+    if hasta:
+        condiciones.append("q.fecha_queja < %s::date + 1")
+        params.append(hasta)
+    if texto:
+        condiciones.append(f"{_QUEJAS_TSVECTOR.format(t='q.')} @@ plainto_tsquery('spanish', %s)")
+        params.append(texto)
+
+    where = ("WHERE " + " AND ".join(condiciones)) if condiciones else ""
+    pagina = max(int(pagina), 1)
+
+    conn = get_db_connection(solo_lectura=True)
+    try:
+        cursor = conn.cursor()
+        resumen = not (licencia_guia or desde or hasta or texto)
+        if resumen:
+            cursor.execute("""
+                SELECT COALESCE(SUM(total), 0) FROM QUEJAS_RESUMEN_ESTADO WHERE %s IS NULL OR estado = %s
+            """, (estado, estado))
+        else:
+            # Una fila más que el máximo indica que el conteo quedó truncado
+            cursor.execute(f"""
+                SELECT COUNT(*) FROM (SELECT 1 FROM QUEJAS q {where} LIMIT %s) coincidencias
+            """, params + [QUEJAS_CONTEO_MAXIMO + 1])
+        total = int(cursor.fetchone()[0])
+        es_minimo = not resumen and total > QUEJAS_CONTEO_MAXIMO
+        if es_minimo:
+            total = QUEJAS_CONTEO_MAXIMO
+        else:
+            pagina = min(pagina, max((total + por_pagina - 1) // por_pagina, 1))
+
+        cursor.execute(f"""
+            SELECT q.id, q.licencia_guia, g.nombre as nombre_guia, q.fecha_queja,
+                   q.descripcion, q.estado, q.reportado_por
+            FROM QUEJAS q
+            JOIN GUIAS g ON q.licencia_guia = g.licencia
+            {where}
+            ORDER BY q.fecha_queja DESC, q.id DESC
+            LIMIT %s OFFSET %s
+        """, params + [por_pagina, (pagina - 1) * por_pagina])
+        return cursor.fetchall(), total, pagina, es_minimo
+    except psycopg2.Error as e:
+        print(f"Error en búsqueda de quejas: {e}")
+        return [], 0, 1, False
+    finally:
+        if conn: conn.close()
+
 def actualizar_estado_queja(queja_id, nuevo_estado):
     conn = get_db_connection()
     try:
         cursor = conn.cursor()
+        # Bloquear la fila para conocer el estado anterior y ajustar los resúmenes
+        cursor.execute("SELECT licencia_guia, fecha_queja, estado FROM QUEJAS WHERE id = %s FOR UPDATE", (queja_id,))
+        anterior = cursor.fetchone()
+        if not anterior:
+            return False
+        licencia_guia, fecha_queja, estado_anterior = anterior
         cursor.execute("UPDATE QUEJAS SET estado = %s WHERE id = %s", (nuevo_estado, queja_id))
+        if estado_anterior != nuevo_estado:
+            _ajustar_resumen_quejas(cursor, licencia_guia, fecha_queja, {estado_anterior: -1, nuevo_estado: 1})
         conn.commit()
-        return cursor.rowcount > 0
+        return True
     except psycopg2.Error:
         return False
     finally:
@@ -453,14 +1072,102 @@ def eliminar_queja_db(queja_id):
     conn = get_db_connection()
     try:
         cursor = conn.cursor()
-        cursor.execute("DELETE FROM QUEJAS WHERE id = %s", (queja_id,))
+        cursor.execute("DELETE FROM QUEJAS WHERE id = %s RETURNING licencia_guia, fecha_queja, estado", (queja_id,))
+        eliminada = cursor.fetchone()
+        if eliminada:
+            licencia_guia, fecha_queja, estado = eliminada
+            _ajustar_resumen_quejas(cursor, licencia_guia, fecha_queja, {estado: -1})
         conn.commit()
-        return cursor.rowcount > 0
+        return eliminada is not None
     except psycopg2.Error:
         return False
     finally:
         if conn: conn.close()
 
+# --- Analítica de quejas (lecturas sobre las tablas de resumen) ---
+
+def obtener_guias_con_mas_quejas_abiertas(limite=10):
+    conn = get_db_connection(solo_lectura=True)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT r.licencia_guia, g.nombre, r.abiertas, r.total
+            FROM QUEJAS_RESUMEN_GUIA r JOIN GUIAS g ON g.licencia = r.licencia_guia
+            WHERE r.abiertas > 0
+            ORDER BY r.abiertas DESC
+            LIMIT %s
+        """, (limite,))
+        return cursor.fetchall()
+    except psycopg2.Error:
+        return []
+    finally:
+        if conn: conn.close()
+
+def obtener_quejas_por_estado():
+    conn = get_db_connection(solo_lectura=True)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT estado, total FROM QUEJAS_RESUMEN_ESTADO WHERE total > 0 ORDER BY estado")
+        return cursor.fetchall()
+    except psycopg2.Error:
+        return []
+    finally:
+        if conn: conn.close()
+
+def obtener_quejas_por_semana(semanas=12):
+    """Devuelve [(semana, {estado: total}, total_semana)] de las últimas 'semanas' semanas."""
+    conn = get_db_connection(solo_lectura=True)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT semana, estado, total FROM QUEJAS_RESUMEN_SEMANA
+            WHERE semana >= DATE_TRUNC('week', CURRENT_DATE)::date - (%s * 7) AND total > 0
+            ORDER BY semana DESC
+        """, (semanas - 1,))
+        por_semana = {}
+        for semana, estado, total in cursor.fetchall():
+            por_semana.setdefault(semana, {})[estado] = total
+        return [(semana, estados, sum(estados.values())) for semana, estados in por_semana.items()]
+    except psycopg2.Error:
+        return []
+    finally:
+        if conn: conn.close()
+
+def recalcular_resumen_quejas():
+    """Reconstruye las tablas de resumen desde QUEJAS (reconciliación completa). Devuelve las quejas contadas."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        # SHARE bloquea escrituras en QUEJAS mientras se recalcula, pero no las lecturas
+        cursor.execute("LOCK TABLE QUEJAS IN SHARE MODE")
+        cursor.execute("DELETE FROM QUEJAS_RESUMEN_GUIA")
+        cursor.execute("DELETE FROM QUEJAS_RESUMEN_SEMANA")
+        cursor.execute("DELETE FROM QUEJAS_RESUMEN_ESTADO")
+        cursor.execute("""
+            INSERT INTO QUEJAS_RESUMEN_GUIA (licencia_guia, total, abiertas)
+            SELECT licencia_guia, COUNT(*), COUNT(*) FILTER (WHERE estado = ANY(%s))
+            FROM QUEJAS GROUP BY licencia_guia
+        """, (list(ESTADOS_QUEJA_ABIERTOS),))
+        cursor.execute("""
+            INSERT INTO QUEJAS_RESUMEN_SEMANA (semana, estado, total)
+            SELECT DATE_TRUNC('week', fecha_queja)::date, estado, COUNT(*)
+            FROM QUEJAS GROUP BY 1, 2
+        """)
+        cursor.execute("""
+            INSERT INTO QUEJAS_RESUMEN_ESTADO (estado, total)
+            SELECT estado, COUNT(*) FROM QUEJAS GROUP BY estado
+        """)
+        cursor.execute("SELECT COALESCE(SUM(total), 0) FROM QUEJAS_RESUMEN_ESTADO")
+        total = cursor.fetchone()[0]
+        conn.commit()
+        return total
+    except psycopg2.Error as e:
+        print(f"Error al recalcular el resumen de quejas: {e}")
+        if conn: conn.rollback()
+        raise
+    finally:
+        if conn: conn.close()
+
 # --------------------------------------------------------------------------
 # 7. FUNCIONES DE DISPONIBILIDAD (SOLO FECHAS) Y BÚSQUEDA
 # --------------------------------------------------------------------------
@@ -480,17 +1187,22 @@ def agregar_disponibilidad_fecha(licencia_guia, fecha, hora_inicio, hora_fin):
     finally:
         if conn: conn.close()
 
-def obtener_disponibilidad_fechas(licencia_guia):
-    conn = get_db_connection()
+def obtener_disponibilidad_fechas(licencia_guia, propagar_errores=False):
+    conn = get_db_connection(solo_lectura=True)
     data = []
     try:
         cursor = conn.cursor()
         # En PostgreSQL, usamos AGE para comparar fechas/tiempos, pero aquí DATE(NOW()) es suficiente para comparar solo la fecha.
         cursor.execute("""
-            SELECT id, fecha, hora_inicio as inicio, hora_fin as fin
-            FROM DISPONIBILIDAD_FECHAS 
-            WHERE licencia_guia = %s AND fecha >= CURRENT_DATE
-            ORDER BY fecha ASC
+            SELECT DF.id, DF.fecha, DF.hora_inicio as inicio, DF.hora_fin as fin,
+                   CASE WHEN EXISTS (
+                       SELECT 1 FROM RESERVAS R
+                       WHERE R.disponibilidad_id = DF.id
+                         AND (R.estado = 'confirmada' OR (R.estado = 'retenida' AND R.retenida_hasta > NOW()))
+                   ) THEN 'Reservado' ELSE 'Libre' END as estado
+            FROM DISPONIBILIDAD_FECHAS DF
+            WHERE DF.licencia_guia = %s AND DF.fecha >= CURRENT_DATE
+            ORDER BY DF.fecha ASC
         """, (licencia_guia,))
         
         # Obtenemos los nombres de las columnas para crear diccionarios (similar a row_factory)
@@ -498,6 +1210,8 @@ def obtener_disponibilidad_fechas(licencia_guia):
         data = [dict(zip(column_names, row)) for row in cursor.fetchall()]
         return data
     except psycopg2.Error:
+        if propagar_errores:
+            raise
         return []
     finally:
         if conn: conn.close()
@@ -506,17 +1220,104 @@ def eliminar_disponibilidad_fecha(fecha_id, licencia_guia):
     conn = get_db_connection()
     try:
         cursor = conn.cursor()
-        cursor.execute("DELETE FROM DISPONIBILIDAD_FECHAS WHERE id = %s AND licencia_guia = %s", 
-                       (fecha_id, licencia_guia))
+        # Bloquear el turno como crear_reserva: sin el bloqueo, una retención creada entre la
+        # verificación y el DELETE quedaría con disponibilidad_id NULL (ON DELETE SET NULL)
+        cursor.execute("""
+            SELECT id FROM DISPONIBILIDAD_FECHAS WHERE id = %s AND licencia_guia = %s FOR UPDATE
+        """, (fecha_id, licencia_guia))
+        if not cursor.fetchone():
+            conn.rollback()
+            return False
+
+        # No se elimina un turno que tiene una reserva activa
+        cursor.execute("""
+            DELETE FROM DISPONIBILIDAD_FECHAS DF
+            WHERE DF.id = %s
+              AND NOT EXISTS (
+                  SELECT 1 FROM RESERVAS R
+                  WHERE R.disponibilidad_id = DF.id
+                    AND (R.estado = 'confirmada' OR (R.estado = 'retenida' AND R.retenida_hasta > NOW()))
+              )
+        """, (fecha_id,))
         conn.commit()
         return cursor.rowcount > 0
     except psycopg2.Error:
+        if conn: conn.rollback()
         return False
     finally:
         if conn: conn.close()
 
-def buscar_guias_disponibles_por_fecha(fecha_buscada, idioma_id=None):
+def _asegurar_particiones_historico(cursor, desde, hasta):
+    """Crea las particiones mensuales de DISPONIBILIDAD_HISTORICO que cubren [desde, hasta]."""
+    creadas = 0
+    mes = desde.replace(day=1)
+    while mes <= hasta:
+        siguiente = (mes.replace(day=28) + timedelta(days=4)).replace(day=1)
+        nombre = f"disponibilidad_historico_{mes.year}_{mes.month:02d}"
+        cursor.execute("SELECT to_regclass(%s)", (nombre,))
+        if cursor.fetchone()[0] is None:
+            cursor.execute(sql.SQL(
+                "CREATE TABLE IF NOT EXISTS {} PARTITION OF DISPONIBILIDAD_HISTORICO FOR VALUES FROM (%s) TO (%s)"
+            ).format(sql.Identifier(nombre)), (mes, siguiente))
+            creadas += 1
+        mes = siguiente
+    return creadas
+
+def archivar_disponibilidad_pasada(tamano_lote=5000):
+    """
+    Mueve las filas de DISPONIBILIDAD_FECHAS con fecha pasada a DISPONIBILIDAD_HISTORICO,
+    en lotes de tamano_lote filas (una transacción por lote) para no bloquear la tabla viva.
+    Cada lote asegura las particiones de sus propias fechas, de modo que una ejecución que
+    cruza la medianoche o filas pasadas insertadas durante la ejecución no la hacen fallar.
+    Devuelve estadísticas: filas movidas, lotes, particiones creadas y segundos empleados.
+    """
+    inicio = time.monotonic()
+    estadisticas = {'filas_movidas': 0, 'lotes': 0, 'particiones_creadas': 0}
+
     conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        while True:
+            cursor.execute("""
+                SELECT id, fecha FROM DISPONIBILIDAD_FECHAS
+                WHERE fecha < CURRENT_DATE
+                ORDER BY fecha
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            """, (tamano_lote,))
+            lote = cursor.fetchall()
+            if not lote:
+                conn.rollback()
+                break
+
+            fechas = [fila[1] for fila in lote]
+            estadisticas['particiones_creadas'] += _asegurar_particiones_historico(cursor, min(fechas), max(fechas))
+            cursor.execute("""
+                WITH movidas AS (
+                    DELETE FROM DISPONIBILIDAD_FECHAS WHERE id = ANY(%s)
+                    RETURNING id, licencia_guia, fecha, hora_inicio, hora_fin
+                )
+                INSERT INTO DISPONIBILIDAD_HISTORICO (id, licencia_guia, fecha, hora_inicio, hora_fin)
+                SELECT id, licencia_guia, fecha, hora_inicio, hora_fin FROM movidas
+            """, ([fila[0] for fila in lote],))
+            movidas = cursor.rowcount
+            conn.commit()
+            estadisticas['filas_movidas'] += movidas
+            estadisticas['lotes'] += 1
+            if len(lote) < tamano_lote:
+                break
+    except psycopg2.Error as e:
+        print(f"Error al archivar disponibilidad: {e}")
+        if conn: conn.rollback()
+        raise
+    finally:
+        if conn: conn.close()
+
+    estadisticas['segundos'] = round(time.monotonic() - inicio, 3)
+    return estadisticas
+
+def buscar_guias_disponibles_por_fecha(fecha_buscada, idioma_id=None, propagar_errores=False):
+    conn = get_db_connection(solo_lectura=True)
     guias = []
     try:
         cursor = conn.cursor()
@@ -524,11 +1325,17 @@ def buscar_guias_disponibles_por_fecha(fecha_buscada, idioma_id=None):
         base_query = """
             SELECT 
                 G.licencia, G.nombre, G.telefono, G.email, G.bio, 
+                DF.id as disponibilidad_id,
                 TO_CHAR(DF.hora_inicio, 'HH24:MI') as hora_inicio, 
                 TO_CHAR(DF.hora_fin, 'HH24:MI') as hora_fin
             FROM GUIAS G
             JOIN DISPONIBILIDAD_FECHAS DF ON G.licencia = DF.licencia_guia
             WHERE DF.fecha = %s AND G.aprobado = 1
+              AND NOT EXISTS (
+                  SELECT 1 FROM RESERVAS R
+                  WHERE R.disponibilidad_id = DF.id
+                    AND (R.estado = 'confirmada' OR (R.estado = 'retenida' AND R.retenida_hasta > NOW()))
+              )
         """
         params = [fecha_buscada]
         
@@ -548,7 +1355,7 @@ def buscar_guias_disponibles_por_fecha(fecha_buscada, idioma_id=None):
         guias = [dict(zip(column_names, row)) for row in cursor.fetchall()]
 
         licencias = [g['licencia'] for g in guias]
-        idiomas_por_guia = obtener_idiomas_de_multiples_guias(licencias)
+        idiomas_por_guia = obtener_idiomas_de_multiples_guias(licencias, propagar_errores)
         
         for guia in guias:
             guia['idiomas_dominados'] = idiomas_por_guia.get(guia['licencia'], 'N/A')
@@ -556,11 +1363,526 @@ def buscar_guias_disponibles_por_fecha(fecha_buscada, idioma_id=None):
         return guias
     except psycopg2.Error as e:
         print(f"Error en búsqueda: {e}")
+        if propagar_errores:
+            raise
+        return []
+    finally:
+        if conn: conn.close()
+
+def obtener_datos_cobertura(desde, hasta):
+    """
+    Lectura masiva para el reporte de cobertura (ver cobertura.py). Devuelve dos textos en formato
+    COPY (enteros separados por tabuladores), leídos en la misma instantánea:
+      - turnos libres entre desde y hasta: indice_guia, dia (desde = 0), hora_inicio, hora_fin
+        (horas enteras; hora_fin redondeada hacia arriba)
+      - idiomas de los guías aprobados: indice_guia, idioma_id
+    El índice de guía es la posición de la licencia entre los guías aprobados. Devuelve None si falla.
+    """
+    guias_aprobados = """
+        WITH G AS (
+            SELECT licencia, (ROW_NUMBER() OVER (ORDER BY licencia) - 1)::int AS indice
+            FROM GUIAS WHERE aprobado = 1
+        )
+    """
+    consulta_turnos = guias_aprobados + """
+        SELECT G.indice, DF.fecha - %s::date,
+               EXTRACT(HOUR FROM DF.hora_inicio)::int,
+               CEIL(EXTRACT(EPOCH FROM DF.hora_fin) / 3600)::int
+        FROM DISPONIBILIDAD_FECHAS DF JOIN G ON G.licencia = DF.licencia_guia
+        WHERE DF.fecha BETWEEN %s AND %s
+          AND NOT EXISTS (
+              SELECT 1 FROM RESERVAS R
+              WHERE R.disponibilidad_id = DF.id
+                AND (R.estado = 'confirmada' OR (R.estado = 'retenida' AND R.retenida_hasta > NOW()))
+          )
+    """
+    consulta_idiomas = guias_aprobados + """
+        SELECT G.indice, GI.idioma_id FROM GUIA_IDIOMAS GI JOIN G ON G.licencia = GI.licencia
+    """
+    conn = get_db_connection(solo_lectura=True)
+    try:
+        # Ambas lecturas deben numerar a los guías igual: misma transacción e instantánea
+        conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+        cursor = conn.cursor()
+        textos = []
+        for consulta, params in ((consulta_turnos, (desde, desde, hasta)), (consulta_idiomas, ())):
+            buffer = io.StringIO()
+            cursor.copy_expert(f"COPY ({cursor.mogrify(consulta, params).decode()}) TO STDOUT", buffer)
+            textos.append(buffer.getvalue())
+        conn.rollback()  # Solo lectura: rollback no marca la petición como escritora
+        return tuple(textos)
+    except psycopg2.Error as e:
+        print(f"Error al leer datos de cobertura: {e}")
+        return None
+    finally:
+        if conn: conn.close()
+
+def agregar_disponibilidad_fechas_masiva(licencia_guia, franjas):
+    """
+    Inserta varias franjas (fecha, hora_inicio, hora_fin) de un guía en una sola sentencia.
+    Las fechas ya registradas se ignoran. Devuelve la cantidad de filas insertadas.
+    """
+    if not franjas:
+        return 0
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        insertadas = execute_values(cursor, """
+            INSERT INTO DISPONIBILIDAD_FECHAS (licencia_guia, fecha, hora_inicio, hora_fin)
+            VALUES %s
+            ON CONFLICT (licencia_guia, fecha) DO NOTHING
+            RETURNING id
+        """, [(licencia_guia, f, i, h) for f, i, h in franjas], fetch=True)
+        conn.commit()
+        return len(insertadas)
+    except psycopg2.Error:
+        if conn: conn.rollback()
+        raise
+    finally:
+        if conn: conn.close()
+
+# --------------------------------------------------------------------------
+# 8. COLA DE TRABAJOS EN SEGUNDO PLANO (ver worker.py)
+# --------------------------------------------------------------------------
+
+def encolar_trabajo(tipo, payload=None, prioridad=100, max_intentos=3, creado_por=None):
+    """Registra un trabajo pendiente y devuelve su id (o None si falla)."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO TRABAJOS (tipo, payload, prioridad, max_intentos, creado_por)
+            VALUES (%s, %s, %s, %s, %s) RETURNING id
+        """, (tipo, Json(payload or {}), prioridad, max_intentos, creado_por))
+        trabajo_id = cursor.fetchone()[0]
+        conn.commit()
+        return trabajo_id
+    except psycopg2.Error as e:
+        print(f"Error al encolar trabajo {tipo}: {e}")
+        return None
+    finally:
+        if conn: conn.close()
+
+def tomar_siguiente_trabajo(worker_id, limites, lease_segundos=300):
+    """
+    Reserva el siguiente trabajo ejecutable con FOR UPDATE SKIP LOCKED, de modo que
+    varios workers nunca tomen el mismo trabajo ni se bloqueen entre sí.
+    También recupera trabajos 'en_proceso' cuyo lease expiró (worker caído); la recuperación
+    cuenta como un intento más, y los que ya agotaron max_intentos quedan 'fallido'.
+
+    limites: {tipo: max_concurrencia}. El cupo se verifica dentro de la misma transacción
+    que reserva el trabajo, bajo un advisory lock por tipo: dos workers no pueden ver a la
+    vez lugar libre para el mismo tipo y superar el límite.
+    Devuelve un diccionario con el trabajo o None si la cola está vacía.
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE TRABAJOS SET estado = 'fallido', bloqueado_hasta = NULL, fecha_fin = NOW(),
+                   ultimo_error = COALESCE(ultimo_error || E'\\n', '') || 'Lease vencido sin renovar (worker caído) en el último intento.'
+            WHERE estado = 'en_proceso' AND bloqueado_hasta < NOW() AND intentos >= max_intentos
+        """)
+        conn.commit()
+
+        excluidos = []
+        while True:
+            cursor.execute("""
+                SELECT id, tipo FROM TRABAJOS
+                WHERE ((estado = 'pendiente' AND ejecutar_despues <= NOW())
+                       OR (estado = 'en_proceso' AND bloqueado_hasta < NOW() AND intentos < max_intentos))
+                  AND tipo = ANY(%s)
+                  AND NOT (tipo = ANY(%s))
+                ORDER BY prioridad, id
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            """, (list(limites), excluidos))
+            candidato = cursor.fetchone()
+            if not candidato:
+                conn.rollback()
+                return None
+            trabajo_id, tipo = candidato
+
+            # Serializa a los workers que reservan este tipo (se libera con el commit/rollback)
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"TRABAJOS_CUPO:{tipo}",))
+            cursor.execute("""
+                SELECT COUNT(*) FROM TRABAJOS
+                WHERE tipo = %s AND estado = 'en_proceso' AND bloqueado_hasta >= NOW() AND id <> %s
+            """, (tipo, trabajo_id))
+            if cursor.fetchone()[0] < limites[tipo]:
+                break
+            # Tipo saturado: soltar el candidato y probar con los demás tipos
+            conn.rollback()
+            excluidos.append(tipo)
+
+        cursor.execute("""
+            UPDATE TRABAJOS SET
+                estado = 'en_proceso',
+                intentos = intentos + 1,
+                bloqueado_por = %s,
+                bloqueado_hasta = NOW() + make_interval(secs => %s),
+                fecha_inicio = NOW()
+            WHERE id = %s
+            RETURNING id, tipo, payload, intentos, max_intentos
+        """, (worker_id, lease_segundos, trabajo_id))
+        row = cursor.fetchone()
+        column_names = [desc[0] for desc in cursor.description]
+        conn.commit()
+        return dict(zip(column_names, row))
+    except psycopg2.Error as e:
+        print(f"Error al tomar trabajo: {e}")
+        if conn: conn.rollback()
+        return None
+    finally:
+        if conn: conn.close()
+
+def encolar_trabajo_periodico(tipo, intervalo_segundos, payload=None):
+    """
+    Encola un trabajo de tipo 'tipo' solo si no hay uno pendiente/en proceso ni se creó
+    otro en los últimos intervalo_segundos. Seguro con varios workers (advisory lock).
+    Devuelve el id del trabajo creado o None.
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"TRABAJOS:{tipo}",))
+        cursor.execute("""
+            INSERT INTO TRABAJOS (tipo, payload, creado_por)
+            SELECT %s, %s, 'sistema'
+            WHERE NOT EXISTS (
+                SELECT 1 FROM TRABAJOS
+                WHERE tipo = %s
+                  AND (estado IN ('pendiente', 'en_proceso')
+                       OR fecha_creacion > NOW() - make_interval(secs => %s))
+            )
+            RETURNING id
+        """, (tipo, Json(payload or {}), tipo, intervalo_segundos))
+        row = cursor.fetchone()
+        conn.commit()
+        return row[0] if row else None
+    except psycopg2.Error as e:
+        print(f"Error al programar trabajo {tipo}: {e}")
+        if conn: conn.rollback()
+        return None
+    finally:
+        if conn: conn.close()
+
+def renovar_lease(trabajo_id, worker_id, lease_segundos):
+    """
+    Extiende el lease de un trabajo en ejecución. Devuelve False si el trabajo ya no pertenece
+    a este worker (el lease venció y otro lo recuperó), o None si la base de datos no respondió
+    (el lease puede seguir vigente: se reintenta en la próxima renovación).
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE TRABAJOS SET bloqueado_hasta = NOW() + make_interval(secs => %s)
+            WHERE id = %s AND estado = 'en_proceso' AND bloqueado_por = %s
+        """, (lease_segundos, trabajo_id, worker_id))
+        conn.commit()
+        return cursor.rowcount > 0
+    except psycopg2.Error as e:
+        print(f"Error al renovar lease del trabajo {trabajo_id}: {e}")
+        return None
+    finally:
+        if conn: conn.close()
+
+# completar_trabajo y fallar_trabajo solo actúan si el trabajo sigue en manos de worker_id:
+# un worker que perdió el lease no puede pisar el estado del que lo recuperó.
+
+def completar_trabajo(trabajo_id, worker_id, resultado=None):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE TRABAJOS SET estado = 'completado', resultado = %s, ultimo_error = NULL,
+                   bloqueado_hasta = NULL, fecha_fin = NOW()
+            WHERE id = %s AND estado = 'en_proceso' AND bloqueado_por = %s
+        """, (Json(resultado), trabajo_id, worker_id))
+        conn.commit()
+        return cursor.rowcount > 0
+    except psycopg2.Error:
+        return False
+    finally:
+        if conn: conn.close()
+
+def fallar_trabajo(trabajo_id, worker_id, error, reintentar_en_segundos=None):
+    """
+    Registra el error de un trabajo. Si se indica reintentar_en_segundos vuelve a
+    'pendiente' con ese retraso (backoff); si no, queda definitivamente 'fallido'.
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        if reintentar_en_segundos is not None:
+            cursor.execute("""
+                UPDATE TRABAJOS SET estado = 'pendiente', ultimo_error = %s, bloqueado_hasta = NULL,
+                       ejecutar_despues = NOW() + make_interval(secs => %s)
+                WHERE id = %s AND estado = 'en_proceso' AND bloqueado_por = %s
+            """, (error, reintentar_en_segundos, trabajo_id, worker_id))
+        else:
+            cursor.execute("""
+                UPDATE TRABAJOS SET estado = 'fallido', ultimo_error = %s, bloqueado_hasta = NULL,
+                       fecha_fin = NOW()
+                WHERE id = %s AND estado = 'en_proceso' AND bloqueado_por = %s
+            """, (error, trabajo_id, worker_id))
+        conn.commit()
+        return cursor.rowcount > 0
+    except psycopg2.Error:
+        return False
+    finally:
+        if conn: conn.close()
+
+def obtener_trabajos(limite=100):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, tipo, estado, intentos, max_intentos, creado_por,
+                   fecha_creacion, fecha_inicio, fecha_fin, ultimo_error
+            FROM TRABAJOS ORDER BY id DESC LIMIT %s
+        """, (limite,))
+        column_names = [desc[0] for desc in cursor.description]
+        return [dict(zip(column_names, row)) for row in cursor.fetchall()]
+    except psycopg2.Error:
         return []
     finally:
         if conn: conn.close()
 
+def obtener_trabajo(trabajo_id):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, tipo, payload, estado, intentos, max_intentos, resultado, ultimo_error,
+                   creado_por, fecha_creacion, ejecutar_despues, fecha_inicio, fecha_fin
+            FROM TRABAJOS WHERE id = %s
+        """, (trabajo_id,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        column_names = [desc[0] for desc in cursor.description]
+        return dict(zip(column_names, row))
+    except psycopg2.Error:
+        return None
+    finally:
+        if conn: conn.close()
+
+# --------------------------------------------------------------------------
+# 9. RESERVAS (retenida -> confirmada -> cancelada; las retenciones vencen)
+# --------------------------------------------------------------------------
+# La exclusión mutua la garantiza PostgreSQL: el turno se bloquea con FOR UPDATE y el índice
+# único parcial idx_reservas_turno_activo impide dos reservas activas para el mismo turno.
+
+RESERVA_RETENCION_MINUTOS = int(os.environ.get('RESERVA_RETENCION_MINUTOS', '15'))
+
+def crear_reserva(disponibilidad_id, cliente_nombre, cliente_contacto, minutos_retencion=None):
+    """
+    Retiene un turno para un cliente. Devuelve el código de la reserva, o None si el turno
+    no existe, es pasado, el guía no está aprobado o ya tiene una reserva activa.
+    """
+    minutos_retencion = minutos_retencion or RESERVA_RETENCION_MINUTOS
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        # Bloquear el turno: las solicitudes concurrentes sobre el mismo turno se serializan aquí
+        cursor.execute("""
+            SELECT DF.licencia_guia, DF.fecha, DF.hora_inicio, DF.hora_fin
+            FROM DISPONIBILIDAD_FECHAS DF JOIN GUIAS G ON G.licencia = DF.licencia_guia
+            WHERE DF.id = %s AND DF.fecha >= CURRENT_DATE AND G.aprobado = 1
+            FOR UPDATE OF DF
+        """, (disponibilidad_id,))
+        turno = cursor.fetchone()
+        if not turno:
+            conn.rollback()
+            return None
+
+        # Liberar una retención vencida del mismo turno antes de intentar la nueva
+        cursor.execute("""
+            UPDATE RESERVAS SET estado = 'expirada'
+            WHERE disponibilidad_id = %s AND estado = 'retenida' AND retenida_hasta <= NOW()
+        """, (disponibilidad_id,))
+
+        codigo = secrets.token_urlsafe(16)
+        cursor.execute("""
+            INSERT INTO RESERVAS (codigo, disponibilidad_id, licencia_guia, fecha, hora_inicio, hora_fin,
+                                  cliente_nombre, cliente_contacto, estado, retenida_hasta)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 'retenida', NOW() + make_interval(mins => %s))
+            ON CONFLICT (disponibilidad_id) WHERE estado IN ('retenida', 'confirmada') DO NOTHING
+            RETURNING id
+        """, (codigo, disponibilidad_id, *turno, cliente_nombre, cliente_contacto, minutos_retencion))
+        creada = cursor.fetchone()
+        conn.commit()
+        return codigo if creada else None
+    except psycopg2.Error as e:
+        print(f"Error al crear reserva: {e}")
+        if conn: conn.rollback()
+        return None
+    finally:
+        if conn: conn.close()
+
+def confirmar_reserva(codigo):
+    """Confirma una reserva retenida que aún no venció."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE RESERVAS SET estado = 'confirmada', fecha_confirmacion = NOW(), retenida_hasta = NULL
+            WHERE codigo = %s AND estado = 'retenida' AND retenida_hasta > NOW()
+        """, (codigo,))
+        conn.commit()
+        return cursor.rowcount > 0
+    except psycopg2.Error:
+        return False
+    finally:
+        if conn: conn.close()
+
+def cancelar_reserva(codigo=None, reserva_id=None, licencia_guia=None):
+    """Cancela una reserva activa: por código (cliente) o por id y licencia (guía)."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        if codigo:
+            condicion, params = "codigo = %s", (codigo,)
+        else:
+            condicion, params = "id = %s AND licencia_guia = %s", (reserva_id, licencia_guia)
+        cursor.execute(f"""
+            UPDATE RESERVAS SET estado = 'cancelada', fecha_cancelacion = NOW(), retenida_hasta = NULL
+            WHERE {condicion} AND estado IN ('retenida', 'confirmada') AND fecha >= CURRENT_DATE
+        """, params)
+        conn.commit()
+        return cursor.rowcount > 0
+    except psycopg2.Error:
+        return False
+    finally:
+        if conn: conn.close()
+
+def obtener_retenciones_vencidas(desde):
+    """
+    Para tiempo_real: las retenciones vencidas en (desde, ahora] que siguen marcadas como
+    'retenida' (su vencimiento no escribe nada, así que no hay NOTIFY) y el próximo vencimiento.
+    Devuelve (ahora, [(fecha, licencia_guia), ...], proximo_vencimiento o None); con desde=None
+    solo calcula ahora y el próximo vencimiento. Los errores se propagan.
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT NOW()")
+        ahora = cursor.fetchone()[0]
+        vencidas = []
+        if desde is not None:
+            cursor.execute("""
+                SELECT DISTINCT fecha, licencia_guia FROM RESERVAS
+                WHERE estado = 'retenida' AND retenida_hasta > %s AND retenida_hasta <= %s AND fecha >= CURRENT_DATE
+            """, (desde, ahora))
+            vencidas = cursor.fetchall()
+        cursor.execute("SELECT MIN(retenida_hasta) FROM RESERVAS WHERE estado = 'retenida' AND retenida_hasta > %s", (ahora,))
+        return ahora, vencidas, cursor.fetchone()[0]
+    finally:
+        if conn: conn.close()
+
+def expirar_reservas_vencidas():
+    """Marca como 'expirada' toda retención vencida. Devuelve la cantidad de reservas expiradas."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE RESERVAS SET estado = 'expirada'
+            WHERE estado = 'retenida' AND retenida_hasta <= NOW()
+        """)
+        conn.commit()
+        return cursor.rowcount
+    except psycopg2.Error as e:
+        print(f"Error al expirar reservas: {e}")
+        raise
+    finally:
+        if conn: conn.close()
+
+def obtener_reserva(codigo):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT R.codigo, R.licencia_guia, G.nombre as nombre_guia, G.telefono, G.email,
+                   R.fecha, TO_CHAR(R.hora_inicio, 'HH24:MI') as hora_inicio, TO_CHAR(R.hora_fin, 'HH24:MI') as hora_fin,
+                   R.cliente_nombre, R.cliente_contacto,
+                   CASE WHEN R.estado = 'retenida' AND R.retenida_hasta <= NOW() THEN 'expirada' ELSE R.estado END as estado,
+                   R.retenida_hasta
+            FROM RESERVAS R JOIN GUIAS G ON G.licencia = R.licencia_guia
+            WHERE R.codigo = %s
+        """, (codigo,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        column_names = [desc[0] for desc in cursor.description]
+        return dict(zip(column_names, row))
+    except psycopg2.Error:
+        return None
+    finally:
+        if conn: conn.close()
+
+def obtener_reservas_de_guia(licencia_guia):
+    """
+    Reservas confirmadas (y completadas) del guía, en el formato de historial_reservas.html:
+    (id, fecha, hora_inicio, duracion_horas, cliente, contacto, estado)
+    """
+    conn = get_db_connection(solo_lectura=True)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, TO_CHAR(fecha, 'DD-MM-YYYY'), TO_CHAR(hora_inicio, 'HH24:MI'),
+                   EXTRACT(EPOCH FROM (hora_fin - hora_inicio)) / 3600.0,
+                   cliente_nombre, cliente_contacto,
+                   CASE WHEN fecha < CURRENT_DATE THEN 'Completada' ELSE 'Confirmada' END
+            FROM RESERVAS
+            WHERE licencia_guia = %s AND estado = 'confirmada'
+            ORDER BY fecha DESC, hora_inicio DESC
+        """, (licencia_guia,))
+        return cursor.fetchall()
+    except psycopg2.Error:
+        return []
+    finally:
+        if conn: conn.close()
+
+def obtener_proximas_reservas_de_guia(licencia_guia):
+    """Reservas activas (retenidas sin vencer o confirmadas) del guía desde hoy en adelante."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, TO_CHAR(fecha, 'DD-MM-YYYY'), TO_CHAR(hora_inicio, 'HH24:MI'), TO_CHAR(hora_fin, 'HH24:MI'),
+                   cliente_nombre, cliente_contacto, estado, retenida_hasta
+            FROM RESERVAS
+            WHERE licencia_guia = %s AND fecha >= CURRENT_DATE
+              AND (estado = 'confirmada' OR (estado = 'retenida' AND retenida_hasta > NOW()))
+            ORDER BY fecha, hora_inicio
+        """, (licencia_guia,))
+        return cursor.fetchall()
+    except psycopg2.Error:
+        return []
+    finally:
+        if conn: conn.close()
+
+# --------------------------------------------------------------------------
+# MÉTRICAS: duración de cada función pública de este módulo (ver metricas.py)
+# --------------------------------------------------------------------------
+
+for _nombre, _funcion in list(globals().items()):
+    if (callable(_funcion) and not _nombre.startswith('_') and not isinstance(_funcion, type)
+            and getattr(_funcion, '__module__', None) == __name__
+            and _nombre not in ('get_db_connection', 'iniciar_contexto_lectura', 'hubo_escritura')):
+        globals()[_nombre] = medir_funcion_db(_nombre, _funcion)
+
 if __name__ == '__main__':
+    import sys
+
+    # python db_manager.py recalcular_quejas -> reconstruye las tablas de resumen de quejas
+    if len(sys.argv) > 1 and sys.argv[1] == 'recalcular_quejas':
+        print(f"Resumen de quejas recalculado: {recalcular_resumen_quejas()} quejas contadas.")
+        sys.exit(0)
+
     # Esto solo funcionará si tienes la variable DATABASE_URL definida localmente para pruebas.
     try:
         print("Intentando inicializar la DB con PostgreSQL...")
@@ -0,0 +1,36 @@
+# gunicorn.conf.py - Configuración de gunicorn (se carga automáticamente desde el directorio de trabajo).
+
+import os
+import shutil
+import tempfile
+
+# Métricas de Prometheus en modo multiproceso: cada worker escribe en este directorio
+# y /metrics agrega los valores de todos (ver metricas.py).
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'guias_prometheus'))
+
+# Workers con hilos solo si se activan los eventos en vivo (EVENTOS_EN_VIVO=1): cada stream
+# (/disponibilidad/eventos) ocupa un hilo durante minutos y con workers síncronos bloquearía el
+# proceso completo. Los streams no usan conexiones a la base de datos; los hilos restantes
+# (GUNICORN_HILOS_PETICIONES) atienden las peticiones normales y acotan las conexiones por worker.
+# Sin eventos en vivo se mantienen los workers síncronos, salvo que se indique otra cosa.
+from tiempo_real import EVENTOS_EN_VIVO, EVENTOS_MAX_CONEXIONES
+
+if EVENTOS_EN_VIVO:
+    worker_class = 'gthread'
+    threads = int(os.environ.get('GUNICORN_THREADS',
+                                 EVENTOS_MAX_CONEXIONES + int(os.environ.get('GUNICORN_HILOS_PETICIONES', '8'))))
+else:
+    worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
+    threads = int(os.environ.get('GUNICORN_THREADS', '1'))
+
+
+def on_starting(server):
+    # Limpiar métricas de ejecuciones anteriores
+    directorio = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(directorio, ignore_errors=True)
+    os.makedirs(directorio, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,267 @@
+# limites.py - Limitación de tasa (token bucket) y descarte de carga para rutas costosas.
+#
+# Los buckets viven en memoria del proceso, o en Redis si REDIS_URL está definida (y el paquete
+# 'redis' instalado), para que el límite sea global entre todos los workers de gunicorn.
+
+import os
+import secrets
+import threading
+import time
+from collections import defaultdict
+from functools import wraps
+
+from flask import request, session, make_response
+
+from metricas import LIMITES_EVENTOS
+
+try:
+    import redis
+except ImportError:  # Dependencia opcional
+    redis = None
+
+
+# --------------------------------------------------------------------------
+# ALMACENES DE BUCKETS
+# --------------------------------------------------------------------------
+
+class AlmacenMemoria:
+    """Token buckets en memoria del proceso (límite por worker)."""
+
+    MAX_BUCKETS = 50000
+
+    def __init__(self):
+        self._buckets = {}
+        self._en_curso = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def consumir(self, clave, capacidad, recarga, costo=1):
+        """Intenta consumir 'costo' tokens. Devuelve (permitido, segundos_para_reintentar)."""
+        ahora = time.monotonic()
+        with self._lock:
+            tokens, ultimo = self._buckets.get(clave, (capacidad, ahora))
+            tokens = min(capacidad, tokens + (ahora - ultimo) * recarga)
+            permitido = tokens >= costo
+            if permitido:
+                tokens -= costo
+            self._buckets[clave] = (tokens, ahora)
+            if len(self._buckets) > self.MAX_BUCKETS:
+                self._purgar(ahora)
+        espera = 0 if permitido else (costo - tokens) / recarga
+        return permitido, espera
+
+    def consultar(self, clave, capacidad, recarga):
+        """Como consumir(), pero sin descontar: indica si queda al menos un token."""
+        ahora = time.monotonic()
+        with self._lock:
+            tokens, ultimo = self._buckets.get(clave, (capacidad, ahora))
+        tokens = min(capacidad, tokens + (ahora - ultimo) * recarga)
+        return tokens >= 1, max(0, (1 - tokens) / recarga)
+
+    def _purgar(self, ahora):
+        # Elimina los buckets inactivos más de 10 minutos (ya estarían llenos de nuevo)
+        for clave in [c for c, (_, ultimo) in self._buckets.items() if ahora - ultimo > 600]:
+            del self._buckets[clave]
+
+    def adquirir(self, clave, maximo):
+        """Reserva un cupo de concurrencia. Devuelve una ficha para liberar(), o None si ya hay 'maximo' en curso."""
+        with self._lock:
+            if self._en_curso[clave] >= maximo:
+                return None
+            self._en_curso[clave] += 1
+            return True
+
+    def liberar(self, clave, ficha):
+        with self._lock:
+            self._en_curso[clave] = max(self._en_curso[clave] - 1, 0)
+
+
+class AlmacenRedis:
+    """Token buckets en Redis, compartidos entre workers. La actualización es atómica (script Lua)."""
+
+    SCRIPT = """
+        local capacidad = tonumber(ARGV[1])
+        local recarga = tonumber(ARGV[2])
+        local costo = tonumber(ARGV[3])
+        local ahora = tonumber(ARGV[4])
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ultimo')
+        local tokens = tonumber(bucket[1]) or capacidad
+        local ultimo = tonumber(bucket[2]) or ahora
+        tokens = math.min(capacidad, tokens + math.max(0, ahora - ultimo) * recarga)
+        local permitido = 0
+        if tokens >= costo then
+            tokens = tokens - costo
+            permitido = 1
+        end
+        redis.call('HSET', KEYS[1], 'tokens', tokens, 'ultimo', ahora)
+        redis.call('EXPIRE', KEYS[1], math.ceil(capacidad / recarga) + 1)
+        return {permitido, tostring(tokens)}
+    """
+
+    # Cupos de concurrencia: un ZSET de fichas con la hora de adquisición. Las fichas más viejas
+    # que el TTL se descartan en cada adquisición, así que un worker caído solo retiene su cupo
+    # hasta que vence, aunque el tráfico continúe; y liberar quita solo la ficha propia.
+    SCRIPT_CUPO = """
+        local maximo = tonumber(ARGV[1])
+        local ahora = tonumber(ARGV[2])
+        local ttl = tonumber(ARGV[3])
+        redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ahora - ttl)
+        if redis.call('ZCARD', KEYS[1]) >= maximo then
+            return 0
+        end
+        redis.call('ZADD', KEYS[1], ahora, ARGV[4])
+        redis.call('EXPIRE', KEYS[1], math.ceil(ttl) + 1)
+        return 1
+    """
+
+    def __init__(self, url):
+        self._redis = redis.Redis.from_url(url, socket_timeout=0.5)
+        self._script = self._redis.register_script(self.SCRIPT)
+        self._script_cupo = self._redis.register_script(self.SCRIPT_CUPO)
+
+    def consumir(self, clave, capacidad, recarga, costo=1):
+        try:
+            permitido, tokens = self._script(keys=[f"limite:{clave}"],
+                                             args=[capacidad, recarga, costo, time.time()])
+        except redis.RedisError:
+            return True, 0  # Si Redis no responde no se bloquea el tráfico
+        tokens = float(tokens)
+        return bool(permitido), 0 if permitido else (costo - tokens) / recarga
+
+    def consultar(self, clave, capacidad, recarga):
+        try:
+            # Con costo 0 el script solo recarga el bucket y devuelve los tokens disponibles
+            _, tokens = self._script(keys=[f"limite:{clave}"], args=[capacidad, recarga, 0, time.time()])
+        except redis.RedisError:
+            return True, 0
+        tokens = float(tokens)
+        return tokens >= 1, max(0, (1 - tokens) / recarga)
+
+    def adquirir(self, clave, maximo, ttl=60):
+        ficha = secrets.token_hex(8)
+        try:
+            if not self._script_cupo(keys=[f"concurrencia:{clave}"], args=[maximo, time.time(), ttl, ficha]):
+                return None
+        except redis.RedisError:
+            pass  # Si Redis no responde no se bloquea el tráfico
+        return ficha
+
+    def liberar(self, clave, ficha):
+        try:
+            self._redis.zrem(f"concurrencia:{clave}", ficha)
+        except redis.RedisError:
+            pass
+
+
+def crear_almacen():
+    url = os.environ.get('REDIS_URL')
+    if url and redis is not None:
+        return AlmacenRedis(url)
+    return AlmacenMemoria()
+
+
+almacen = crear_almacen()
+
+# --------------------------------------------------------------------------
+# CONTADORES (para monitoreo)
+# --------------------------------------------------------------------------
+
+# contadores[nombre_limite][evento] -> cantidad, por worker
+contadores = defaultdict(lambda: defaultdict(int))
+_contadores_lock = threading.Lock()
+
+def contar(nombre, evento):
+    LIMITES_EVENTOS.labels(nombre, evento).inc()
+    with _contadores_lock:
+        contadores[nombre][evento] += 1
+
+def obtener_contadores():
+    with _contadores_lock:
+        return {nombre: dict(eventos) for nombre, eventos in contadores.items()}
+
+# --------------------------------------------------------------------------
+# DECORADORES
+# --------------------------------------------------------------------------
+
+def _respuesta_rechazo(codigo, mensaje, reintentar_en):
+    respuesta = make_response(mensaje, codigo)
+    respuesta.headers['Retry-After'] = str(max(int(reintentar_en + 0.999), 1))
+    return respuesta
+
+def _licencia_de_peticion():
+    """Licencia asociada a la petición: la del formulario (login) o la de la sesión."""
+    return (request.form.get('licencia') or session.get('user_licencia') or '').strip()
+
+# nombre del límite -> (capacidad, recarga) del bucket de fallos por licencia
+_limites_fallos = {}
+
+def _clave_fallos(nombre, licencia):
+    return f"{nombre}:fallos:{licencia}"
+
+def limitar(nombre, capacidad, por_minuto, por_licencia=False, fallos_por_licencia=None, metodos=('POST',)):
+    """
+    Limita la tasa de una ruta con un token bucket por IP (y opcionalmente por licencia e IP).
+    capacidad es la ráfaga máxima y por_minuto la tasa sostenida. Solo se aplica a 'metodos'.
+    fallos_por_licencia=(capacidad, por_minuto) agrega un bucket global por licencia que solo se
+    descuenta con registrar_fallo(): así nadie puede bloquear una licencia ajena (p. ej. la del
+    administrador) sin más que enviar solicitudes desde otra IP, pero una adivinanza de contraseñas
+    distribuida entre muchas IPs sigue limitada.
+    Responde 429 con Retry-After al superar el límite.
+    """
+    recarga = por_minuto / 60.0
+    if fallos_por_licencia:
+        _limites_fallos[nombre] = (fallos_por_licencia[0], fallos_por_licencia[1] / 60.0)
+
+    def decorador(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method not in metodos:
+                return f(*args, **kwargs)
+
+            claves = [f"{nombre}:ip:{request.remote_addr}"]
+            licencia = _licencia_de_peticion() if por_licencia or fallos_por_licencia else ''
+            if licencia and por_licencia:
+                claves.append(f"{nombre}:lic:{licencia}:{request.remote_addr}")
+
+            if licencia and fallos_por_licencia:
+                permitido, espera = almacen.consultar(_clave_fallos(nombre, licencia), *_limites_fallos[nombre])
+                if not permitido:
+                    contar(nombre, 'rechazadas')
+                    return _respuesta_rechazo(429, 'Demasiados intentos fallidos. Intenta nuevamente en unos minutos.', espera)
+
+            for clave in claves:
+                permitido, espera = almacen.consumir(clave, capacidad, recarga)
+                if not permitido:
+                    contar(nombre, 'rechazadas')
+                    return _respuesta_rechazo(429, 'Demasiadas solicitudes. Intenta nuevamente en unos momentos.', espera)
+
+            contar(nombre, 'permitidas')
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorador
+
+def registrar_fallo(nombre):
+    """Descuenta un intento fallido (p. ej. contraseña incorrecta) del bucket por licencia de 'nombre'."""
+    licencia = _licencia_de_peticion()
+    if licencia and nombre in _limites_fallos:
+        almacen.consumir(_clave_fallos(nombre, licencia), *_limites_fallos[nombre])
+        contar(nombre, 'fallidas')
+
+def limitar_concurrencia(nombre, maximo):
+    """
+    Permite como máximo 'maximo' ejecuciones simultáneas de la ruta (en todos los workers si
+    se usa Redis, o por worker en memoria). Las solicitudes que exceden el cupo se descartan
+    de inmediato con 503 en lugar de acumularse ocupando workers y conexiones a la base de datos.
+    """
+    def decorador(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            ficha = almacen.adquirir(nombre, maximo)
+            if ficha is None:
+                contar(nombre, 'descartadas')
+                return _respuesta_rechazo(503, 'El servicio está ocupado. Intenta nuevamente en unos segundos.', 1)
+            try:
+                return f(*args, **kwargs)
+            finally:
+                almacen.liberar(nombre, ficha)
+        return decorated_function
+    return decorador
@@ -0,0 +1,98 @@
+# metricas.py - Métricas en formato Prometheus (rutas, base de datos, caché, login y límites).
+#
+# Con gunicorn (varios procesos) las métricas se agregan en modo multiproceso: la variable
+# PROMETHEUS_MULTIPROC_DIR debe definirse antes de importar este módulo (ver gunicorn.conf.py).
+
+import os
+import time
+from functools import wraps
+
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+)
+
+MULTIPROCESO = bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+# --------------------------------------------------------------------------
+# DEFINICIÓN DE MÉTRICAS
+# --------------------------------------------------------------------------
+
+PETICIONES_DURACION = Histogram(
+    'guias_http_request_duration_seconds', 'Latencia de las peticiones por endpoint de Flask',
+    ['endpoint', 'metodo'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+PETICIONES_TOTAL = Counter(
+    'guias_http_requests_total', 'Peticiones atendidas por endpoint y código de estado',
+    ['endpoint', 'metodo', 'estado'])
+PETICIONES_EN_CURSO = Gauge(
+    'guias_http_requests_in_flight', 'Peticiones en curso', multiprocess_mode='livesum')
+
+DB_LLAMADAS_DURACION = Histogram(
+    'guias_db_call_duration_seconds', 'Duración de las funciones de db_manager (incluye conexión)',
+    ['funcion'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+DB_CONEXIONES_TOTAL = Counter(
+    'guias_db_connections_total', 'Conexiones abiertas a PostgreSQL por destino', ['destino'])
+DB_CONEXIONES_ABIERTAS = Gauge(
+    'guias_db_connections_open', 'Conexiones a PostgreSQL abiertas en este momento', ['destino'],
+    multiprocess_mode='livesum')
+
+CACHE_CONSULTAS = Counter(
+    'guias_cache_lookups_total', 'Consultas a la caché por espacio de claves y resultado', ['espacio', 'resultado'])
+
+LOGIN_FALLIDOS = Counter('guias_login_failures_total', 'Intentos de inicio de sesión fallidos', ['motivo'])
+
+LIMITES_EVENTOS = Counter(
+    'guias_rate_limit_events_total', 'Solicitudes permitidas, rechazadas (429), descartadas (503) o fallidas (login)', ['limite', 'evento'])
+
+# --------------------------------------------------------------------------
+# INSTRUMENTACIÓN
+# --------------------------------------------------------------------------
+
+def medir_funcion_db(nombre, funcion):
+    """Envuelve una función de db_manager para registrar su duración."""
+    histograma = DB_LLAMADAS_DURACION.labels(nombre)
+
+    @wraps(funcion)
+    def funcion_medida(*args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return funcion(*args, **kwargs)
+        finally:
+            histograma.observe(time.perf_counter() - inicio)
+    return funcion_medida
+
+def configurar_metricas(app):
+    """Registra los hooks de latencia por endpoint y la ruta /metrics."""
+    from flask import Response, g, request, abort
+
+    @app.before_request
+    def iniciar_medicion():
+        g.metricas_inicio = time.perf_counter()
+        PETICIONES_EN_CURSO.inc()
+
+    @app.after_request
+    def registrar_medicion(response):
+        inicio = g.pop('metricas_inicio', None)
+        if inicio is not None:
+            endpoint = request.endpoint or 'desconocido'
+            PETICIONES_DURACION.labels(endpoint, request.method).observe(time.perf_counter() - inicio)
+            PETICIONES_TOTAL.labels(endpoint, request.method, response.status_code).inc()
+        return response
+
+    @app.teardown_request
+    def terminar_medicion(exc):
+        PETICIONES_EN_CURSO.dec()
+
+    @app.route('/metrics')
+    def metrics():
+        token = os.environ.get('METRICS_TOKEN')
+        if token and request.headers.get('Authorization') != f"Bearer {token}":
+            abort(403)
+        if MULTIPROCESO:
+            registro = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registro)
+            datos = generate_latest(registro)
+        else:
+            datos = generate_latest()
+        return Response(datos, mimetype=CONTENT_TYPE_LATEST)
@@ -0,0 +1,164 @@
+# perfilador.py - Perfilador por muestreo, activable desde el panel de administración.
+#
+# Cuando está activo, una fracción de las peticiones se muestrea: un hilo auxiliar captura la
+# pila del hilo de la petición cada PERFILADOR_INTERVALO segundos. Las pilas se guardan en formato
+# "folded" (func1;func2;func3 cantidad), compatible con flamegraph.pl y speedscope.
+#
+# La configuración y las muestras viven en un directorio compartido por los workers del servidor
+# (PERFILADOR_DIR). Desactivado, el costo por petición es una comparación de tiempo.
+
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+PERFILADOR_DIR = os.environ.get('PERFILADOR_DIR', os.path.join(tempfile.gettempdir(), 'guias_perfilador'))
+PERFILADOR_INTERVALO = float(os.environ.get('PERFILADOR_INTERVALO', '0.005'))
+_ARCHIVO_CONFIG = os.path.join(PERFILADOR_DIR, 'config.json')
+_RELECTURA_SEGUNDOS = 2.0
+
+_config = {'activo_hasta': 0, 'fraccion': 0}
+_proxima_lectura = 0.0
+_lock_escritura = threading.Lock()
+
+# --------------------------------------------------------------------------
+# CONFIGURACIÓN COMPARTIDA
+# --------------------------------------------------------------------------
+
+def _leer_config():
+    try:
+        with open(_ARCHIVO_CONFIG) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'activo_hasta': 0, 'fraccion': 0}
+
+def obtener_config():
+    """Configuración vigente (releída del disco como máximo cada _RELECTURA_SEGUNDOS)."""
+    global _config, _proxima_lectura
+    ahora = time.monotonic()
+    if ahora >= _proxima_lectura:
+        _config = _leer_config()
+        _proxima_lectura = ahora + _RELECTURA_SEGUNDOS
+    return _config
+
+def activar(fraccion, minutos):
+    os.makedirs(PERFILADOR_DIR, exist_ok=True)
+    config = {'activo_hasta': time.time() + minutos * 60, 'fraccion': fraccion}
+    temporal = _ARCHIVO_CONFIG + '.tmp'
+    with open(temporal, 'w') as f:
+        json.dump(config, f)
+    os.replace(temporal, _ARCHIVO_CONFIG)
+
+def desactivar():
+    try:
+        os.remove(_ARCHIVO_CONFIG)
+    except OSError:
+        pass
+
+def limpiar_muestras():
+    for nombre in _archivos_muestras():
+        try:
+            os.remove(nombre)
+        except OSError:
+            pass
+
+def _archivos_muestras():
+    if not os.path.isdir(PERFILADOR_DIR):
+        return []
+    return [os.path.join(PERFILADOR_DIR, n) for n in os.listdir(PERFILADOR_DIR) if n.startswith('muestras-')]
+
+def debe_muestrear():
+    config = obtener_config()
+    return config['activo_hasta'] > time.time() and random.random() < config['fraccion']
+
+# --------------------------------------------------------------------------
+# MUESTREO
+# --------------------------------------------------------------------------
+
+def _nombre_marco(frame):
+    codigo = frame.f_code
+    return f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})"
+
+def _colapsar(frame, raiz):
+    pila = []
+    while frame is not None:
+        pila.append(_nombre_marco(frame))
+        frame = frame.f_back
+    pila.append(raiz)
+    return ';'.join(reversed(pila))
+
+class Muestreador(threading.Thread):
+    """Captura periódicamente la pila de un hilo hasta que se llama a detener()."""
+
+    def __init__(self, raiz):
+        super().__init__(daemon=True, name='perfilador')
+        self.hilo_id = threading.get_ident()
+        self.raiz = raiz
+        self.pilas = Counter()
+        self._detener = threading.Event()
+
+    def run(self):
+        while not self._detener.wait(PERFILADOR_INTERVALO):
+            frame = sys._current_frames().get(self.hilo_id)
+            if frame is not None:
+                self.pilas[_colapsar(frame, self.raiz)] += 1
+
+    def detener(self):
+        self._detener.set()
+        self.join()
+        _guardar_pilas(self.pilas)
+
+def _guardar_pilas(pilas):
+    if not pilas:
+        return
+    os.makedirs(PERFILADOR_DIR, exist_ok=True)
+    lineas = ''.join(f"{pila} {cantidad}\n" for pila, cantidad in pilas.items())
+    with _lock_escritura:
+        with open(os.path.join(PERFILADOR_DIR, f"muestras-{os.getpid()}.txt"), 'a') as f:
+            f.write(lineas)
+
+def obtener_pilas_agregadas():
+    """Suma las muestras de todos los workers. Devuelve el texto en formato folded."""
+    total = Counter()
+    for nombre in _archivos_muestras():
+        with open(nombre) as f:
+            for linea in f:
+                pila, _, cantidad = linea.rstrip('\n').rpartition(' ')
+                if pila and cantidad.isdigit():
+                    total[pila] += int(cantidad)
+    return ''.join(f"{pila} {cantidad}\n" for pila, cantidad in total.most_common())
+
+def estado():
+    config = obtener_config()
+    restante = max(config['activo_hasta'] - time.time(), 0)
+    archivos = _archivos_muestras()
+    return {
+        'activo': restante > 0,
+        'fraccion': config['fraccion'],
+        'segundos_restantes': int(restante),
+        'workers_con_muestras': len(archivos),
+        'bytes_muestras': sum(os.path.getsize(a) for a in archivos),
+    }
+
+# --------------------------------------------------------------------------
+# INTEGRACIÓN CON FLASK
+# --------------------------------------------------------------------------
+
+def configurar_perfilador(app):
+    from flask import g, request
+
+    @app.before_request
+    def iniciar_muestreo():
+        if debe_muestrear():
+            g.muestreador = Muestreador(raiz=request.endpoint or 'desconocido')
+            g.muestreador.start()
+
+    @app.teardown_request
+    def terminar_muestreo(exc):
+        muestreador = g.pop('muestreador', None)
+        if muestreador is not None:
+            muestreador.detener()
@@ -0,0 +1,84 @@
+# plantillas.py - Configuración de Jinja2: caché de bytecode, precompilación y caché de fragmentos.
+
+import os
+import tempfile
+
+from jinja2 import FileSystemBytecodeCache, MemcachedBytecodeCache, TemplateError, nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from cache import cache, version_grupo
+
+try:
+    import redis
+except ImportError:  # Dependencia opcional
+    redis = None
+
+
+class FragmentCacheExtension(Extension):
+    """
+    Etiqueta {% cache grupo, ttl[, partes...] %} ... {% endcache %}.
+
+    Guarda el HTML renderizado del bloque durante 'ttl' segundos. La clave incluye la versión
+    del grupo (ver cache.invalidar_grupo), así que los escritores de db_manager que cambian
+    esos datos invalidan el fragmento de inmediato. Ejemplo:
+
+        {% cache 'idiomas', 600 %} ... {% endcache %}
+    """
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_renderizar', [nodes.List(args)]),
+                               [], [], body).set_lineno(lineno)
+
+    def _renderizar(self, args, caller):
+        grupo, ttl, *partes = args
+        version = version_grupo(grupo)
+        if version is None:
+            return Markup(caller())
+        clave = ':'.join(['fragmento', str(grupo), str(version)] + [str(p) for p in partes])
+        html = cache.get(clave)
+        if html is None:
+            html = caller()
+            cache.set(clave, str(html), ttl)
+        return Markup(html)
+
+
+def crear_bytecode_cache():
+    """
+    Caché de bytecode compartida: en Redis (entre workers, servidores y despliegues) si
+    REDIS_URL está definida, o en un directorio común para los workers del mismo servidor.
+    Jinja invalida solo las entradas cuyo código fuente cambió.
+    """
+    url = os.environ.get('REDIS_URL')
+    if url and redis is not None:
+        return MemcachedBytecodeCache(redis.Redis.from_url(url, socket_timeout=0.5),
+                                      prefix='jinja2/bytecode/', timeout=7 * 24 * 3600,
+                                      ignore_memcache_errors=True)
+
+    directorio = os.environ.get('JINJA_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'guias_jinja_bytecode'))
+    os.makedirs(directorio, exist_ok=True)
+    return FileSystemBytecodeCache(directorio)
+
+
+def precompilar_plantillas(app):
+    """Compila todas las plantillas al iniciar el worker para no pagar el costo en la primera visita."""
+    compiladas = 0
+    for nombre in app.jinja_env.list_templates(extensions=['html']):
+        try:
+            app.jinja_env.get_template(nombre)
+            compiladas += 1
+        except TemplateError as e:
+            print(f"Aviso: no se pudo precompilar la plantilla {nombre}: {e}")
+    return compiladas
+
+
+def configurar_plantillas(app):
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.bytecode_cache = crear_bytecode_cache()
+    precompilar_plantillas(app)
@@ -0,0 +1,277 @@
+# stress_reservas.py - Prueba de carga del motor de reservas contra una base PostgreSQL real.
+#
+# Crea un guía de prueba con N turnos y lanza muchos hilos que intentan reservar los mismos
+# turnos a la vez. Mide el rendimiento y verifica con SQL que:
+#   - ningún turno quedó con más de una reserva activa;
+#   - cada retención que la aplicación reportó como exitosa existe en la base (y ninguna otra),
+#     con el estado que corresponde a lo que el cliente hizo después (confirmar o cancelar);
+#   - una retención vencida no se puede confirmar y el turno se puede volver a reservar, una
+#     sola vez aunque lo intenten varios clientes a la vez.
+# Al terminar elimina el guía de prueba (y en cascada sus turnos y reservas).
+#
+# Cada hilo reutiliza su propia conexión durante la carga, para que la cifra de intentos/s mida
+# el motor de reservas y no el costo de abrir una conexión por llamada. Con "nuevas" como cuarto
+# argumento se usa una conexión nueva por llamada, como en la aplicación.
+#
+# Uso: DATABASE_URL=postgres://... python stress_reservas.py [turnos] [hilos] [intentos_por_hilo] [nuevas]
+
+import os
+import random
+import sys
+import threading
+import time
+from datetime import date, timedelta
+
+import psycopg2
+
+import db_manager
+from db_manager import (
+    inicializar_db, registrar_guia, cambiar_aprobacion, eliminar_guia,
+    agregar_disponibilidad_fechas_masiva, crear_reserva, confirmar_reserva, cancelar_reserva,
+    expirar_reservas_vencidas, get_db_connection
+)
+
+LICENCIA_PRUEBA = 'STRESS01'
+HILOS_REINTENTO = 8   # Clientes que compiten por un turno cuya retención venció
+
+
+# --------------------------------------------------------------------------
+# CONEXIONES REUTILIZADAS POR HILO
+# --------------------------------------------------------------------------
+
+class _ConexionReutilizada(psycopg2.extensions.connection):
+    """close() solo termina la transacción en curso; la conexión queda lista para la próxima llamada."""
+
+    def close(self):
+        if not self.closed:
+            self.rollback()
+
+    def cerrar(self):
+        super().close()
+
+_locales = threading.local()
+_conexiones = []
+_conexiones_lock = threading.Lock()
+
+def _conexion_del_hilo(solo_lectura=False):
+    conn = getattr(_locales, 'conn', None)
+    if conn is None or conn.closed:
+        conn = psycopg2.connect(os.environ['DATABASE_URL'], connection_factory=_ConexionReutilizada)
+        _locales.conn = conn
+        with _conexiones_lock:
+            _conexiones.append(conn)
+    return conn
+
+def _cerrar_conexiones():
+    for conn in _conexiones:
+        conn.cerrar()
+    _conexiones.clear()
+
+# --------------------------------------------------------------------------
+# CARGA
+# --------------------------------------------------------------------------
+
+def preparar(turnos):
+    inicializar_db()
+    eliminar_guia(LICENCIA_PRUEBA)
+    registrar_guia(LICENCIA_PRUEBA, 'Guía de Prueba de Carga', 'prueba-de-carga')
+    cambiar_aprobacion(LICENCIA_PRUEBA, 1)
+    manana = date.today() + timedelta(days=1)
+    franjas = [((manana + timedelta(days=i)).isoformat(), '09:00', '13:00') for i in range(turnos)]
+    agregar_disponibilidad_fechas_masiva(LICENCIA_PRUEBA, franjas)
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM DISPONIBILIDAD_FECHAS WHERE licencia_guia = %s ORDER BY fecha", (LICENCIA_PRUEBA,))
+        return [fila[0] for fila in cursor.fetchall()]
+    finally:
+        conn.close()
+
+def cliente(turnos, intentos, resultados, barrera):
+    propio = {'retenidas': set(), 'confirmadas': set(), 'canceladas': set(), 'rechazadas': 0, 'errores': []}
+    barrera.wait()
+    for _ in range(intentos):
+        codigo = crear_reserva(random.choice(turnos), 'Cliente de carga', 'carga@ejemplo.com')
+        if not codigo:
+            propio['rechazadas'] += 1
+            continue
+        propio['retenidas'].add(codigo)
+        # Mezclar el ciclo de vida: la mayoría confirma, algunas cancelan y liberan el turno
+        if random.random() < 0.8:
+            if confirmar_reserva(codigo):
+                propio['confirmadas'].add(codigo)
+            else:
+                propio['errores'].append(f"no se pudo confirmar la retención {codigo}")
+        else:
+            if cancelar_reserva(codigo=codigo):
+                propio['canceladas'].add(codigo)
+            else:
+                propio['errores'].append(f"no se pudo cancelar la retención {codigo}")
+    resultados.append(propio)
+
+def _reservas_de_prueba(cursor):
+    cursor.execute("SELECT codigo, estado FROM RESERVAS WHERE licencia_guia = %s", (LICENCIA_PRUEBA,))
+    return dict(cursor.fetchall())
+
+def verificar(resultados):
+    """Compara lo que los clientes vieron con lo que quedó en la base. Devuelve (errores, por_estado)."""
+    errores = [error for r in resultados for error in r['errores']]
+    retenidas = set().union(*(r['retenidas'] for r in resultados))
+    confirmadas = set().union(*(r['confirmadas'] for r in resultados))
+    canceladas = set().union(*(r['canceladas'] for r in resultados))
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT disponibilidad_id, COUNT(*) FROM RESERVAS
+            WHERE licencia_guia = %s AND estado IN ('retenida', 'confirmada')
+            GROUP BY disponibilidad_id HAVING COUNT(*) > 1
+        """, (LICENCIA_PRUEBA,))
+        sobrerreservas = cursor.fetchall()
+        en_db = _reservas_de_prueba(cursor)
+    finally:
+        conn.close()
+
+    if sobrerreservas:
+        errores.append(f"{len(sobrerreservas)} turno(s) con más de una reserva activa: {sobrerreservas}")
+    if len(retenidas) != sum(len(r['retenidas']) for r in resultados):
+        errores.append("la aplicación devolvió el mismo código para dos retenciones")
+    faltantes = retenidas - en_db.keys()
+    sobrantes = en_db.keys() - retenidas
+    if faltantes:
+        errores.append(f"{len(faltantes)} retención(es) exitosa(s) que no están en la base")
+    if sobrantes:
+        errores.append(f"{len(sobrantes)} reserva(s) en la base que ningún cliente obtuvo")
+    for codigo in retenidas & en_db.keys():
+        esperado = 'confirmada' if codigo in confirmadas else 'cancelada' if codigo in canceladas else 'retenida'
+        if en_db[codigo] != esperado:
+            errores.append(f"la reserva {codigo} está '{en_db[codigo]}' y se esperaba '{esperado}'")
+
+    por_estado = {}
+    for estado in en_db.values():
+        por_estado[estado] = por_estado.get(estado, 0) + 1
+    return errores, por_estado
+
+# --------------------------------------------------------------------------
+# VENCIMIENTO Y NUEVA RESERVA
+# --------------------------------------------------------------------------
+
+def _vencer(codigo):
+    """Adelanta el vencimiento de una retención (la retención mínima es de un minuto)."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE RESERVAS SET retenida_hasta = NOW() - INTERVAL '1 second' WHERE codigo = %s", (codigo,))
+        conn.commit()
+    finally:
+        conn.close()
+
+def _competir_por(turno):
+    """Varios clientes intentan reservar el mismo turno a la vez. Devuelve los códigos obtenidos."""
+    codigos = []
+    barrera = threading.Barrier(HILOS_REINTENTO)
+
+    def intentar():
+        barrera.wait()
+        codigo = crear_reserva(turno, 'Cliente de reintento', 'reintento@ejemplo.com')
+        if codigo:
+            codigos.append(codigo)
+
+    hilos = [threading.Thread(target=intentar) for _ in range(HILOS_REINTENTO)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    return codigos
+
+def probar_vencimiento(turno):
+    """
+    Dos rondas sobre un turno libre: en la primera la retención vencida la libera crear_reserva
+    al reservar de nuevo; en la segunda la marca expirar_reservas_vencidas (tarea del worker).
+    """
+    errores = []
+    codigo = crear_reserva(turno, 'Cliente que no paga', 'vence@ejemplo.com')
+    if not codigo:
+        return ["no se pudo retener el turno de la prueba de vencimiento"]
+    if crear_reserva(turno, 'Cliente tardío', 'tarde@ejemplo.com'):
+        errores.append("se retuvo un turno que ya tenía una retención vigente")
+
+    for ronda, expirar_antes in ((1, False), (2, True)):
+        _vencer(codigo)
+        if confirmar_reserva(codigo):
+            errores.append(f"ronda {ronda}: se confirmó una retención vencida")
+        if expirar_antes and expirar_reservas_vencidas() < 1:
+            errores.append(f"ronda {ronda}: expirar_reservas_vencidas no expiró la retención vencida")
+        nuevos = _competir_por(turno)
+        if len(nuevos) != 1:
+            errores.append(f"ronda {ronda}: {len(nuevos)} clientes retuvieron el turno vencido (se esperaba 1)")
+            break
+
+        conn = get_db_connection()
+        try:
+            en_db = _reservas_de_prueba(conn.cursor())
+        finally:
+            conn.close()
+        if en_db.get(codigo) != 'expirada':
+            errores.append(f"ronda {ronda}: la retención vencida quedó '{en_db.get(codigo)}' en lugar de 'expirada'")
+        codigo = nuevos[0]
+
+    if not errores and not confirmar_reserva(codigo):
+        errores.append("no se pudo confirmar la nueva retención del turno liberado")
+    return errores
+
+# --------------------------------------------------------------------------
+# PROGRAMA
+# --------------------------------------------------------------------------
+
+def main():
+    if not os.environ.get('DATABASE_URL'):
+        sys.exit("Define DATABASE_URL con una base de datos de prueba.")
+    n_turnos = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    n_hilos = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    intentos = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    reutilizar = not (len(sys.argv) > 4 and sys.argv[4] == 'nuevas')
+
+    # Un turno extra, fuera de la carga, para la prueba de vencimiento
+    *turnos, turno_vencimiento = preparar(n_turnos + 1)
+    resultados = []
+    barrera = threading.Barrier(n_hilos)
+    hilos = [threading.Thread(target=cliente, args=(turnos, intentos, resultados, barrera)) for _ in range(n_hilos)]
+    try:
+        if reutilizar:
+            db_manager.get_db_connection = _conexion_del_hilo
+        try:
+            inicio = time.perf_counter()
+            for h in hilos:
+                h.start()
+            for h in hilos:
+                h.join()
+            duracion = time.perf_counter() - inicio
+        finally:
+            db_manager.get_db_connection = get_db_connection
+            _cerrar_conexiones()
+
+        exitos = sum(len(r['retenidas']) for r in resultados)
+        rechazadas = sum(r['rechazadas'] for r in resultados)
+        total = exitos + rechazadas
+        print(f"{n_hilos} hilos x {intentos} intentos sobre {len(turnos)} turnos en {duracion:.2f}s "
+              f"({total / duracion:.0f} intentos/s, conexiones {'reutilizadas' if reutilizar else 'nuevas'})")
+        print(f"Retenciones obtenidas: {exitos} | Rechazadas (turno ocupado): {rechazadas}")
+
+        errores, por_estado = verificar(resultados)
+        print("Reservas por estado: " + ', '.join(f"{estado}={cantidad}" for estado, cantidad in sorted(por_estado.items())))
+        errores += probar_vencimiento(turno_vencimiento)
+        if errores:
+            for error in errores:
+                print(f"ERROR: {error}")
+            sys.exit(1)
+        print("OK: sin sobrerreservas, la base coincide con lo que vieron los clientes "
+              "y los turnos vencidos se vuelven a reservar una sola vez.")
+    finally:
+        eliminar_guia(LICENCIA_PRUEBA)
+
+
+if __name__ == '__main__':
+    main()
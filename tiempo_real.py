@@ -0,0 +1,280 @@
+# tiempo_real.py - Cambios de disponibilidad en vivo: LISTEN/NOTIFY de PostgreSQL -> server-sent events.
+#
+# Los triggers de db_manager publican en los canales CANAL_DISPONIBILIDAD y CANAL_GUIAS qué fechas
+# y guías cambiaron. Cada proceso web mantiene UN solo oyente (hilo + conexión con LISTEN) que,
+# ante una notificación, vuelve a consultar una vez cada vista suscrita afectada (una búsqueda
+# fecha/idioma o la disponibilidad de un guía), calcula la diferencia con la instantánea anterior
+# y la reparte a todas las conexiones SSE de esa vista. El costo por cambio depende de la cantidad
+# de vistas distintas, no de la cantidad de suscriptores.
+#
+# Una retención que vence no escribe nada en RESERVAS, así que no genera NOTIFY (la tarea
+# expirar_reservas del worker la marca recién minutos después). En lugar de acortar el intervalo
+# de esa tarea, el oyente programa un temporizador para el próximo retenida_hasta y, al vencer,
+# refresca solo las vistas de esas fechas y guías. El costo es una consulta corta sobre el índice
+# parcial de retenciones por cada lote de notificaciones y por cada vencimiento.
+
+import json
+import os
+import queue
+import select
+import threading
+import time
+from datetime import date, time as hora
+
+# Los streams ocupan un hilo durante minutos: solo se activan con workers gthread de gunicorn,
+# que gunicorn.conf.py usa cuando EVENTOS_EN_VIVO=1. Sin ellos las páginas funcionan sin eventos.
+EVENTOS_EN_VIVO = os.environ.get('EVENTOS_EN_VIVO', '0') == '1'
+EVENTOS_MAX_CONEXIONES = int(os.environ.get('EVENTOS_MAX_CONEXIONES', '48'))    # Streams SSE por proceso (< threads)
+EVENTOS_DURACION_MAXIMA = int(os.environ.get('EVENTOS_DURACION_MAXIMA', '300'))  # El navegador reconecta solo
+EVENTOS_PING_SEGUNDOS = 15
+_AGRUPAR_SEGUNDOS = 0.2      # Ventana para agrupar notificaciones seguidas en una sola actualización
+_RECONEXION_SEGUNDOS = 5
+_COLA_MAXIMA = 50            # Eventos pendientes por conexión antes de cerrarla (cliente lento)
+
+# --------------------------------------------------------------------------
+# VISTAS SUSCRIBIBLES
+# --------------------------------------------------------------------------
+# Una clave identifica una vista: ('busqueda', fecha ISO, idioma_id o None) o ('guia', licencia).
+
+def clave_busqueda(fecha, idioma_id=None):
+    return ('busqueda', fecha.isoformat(), idioma_id)
+
+def clave_guia(licencia):
+    return ('guia', licencia)
+
+def _serializable(valor):
+    if isinstance(valor, (date, hora)):
+        return valor.isoformat()[:5] if isinstance(valor, hora) else valor.isoformat()
+    return valor
+
+def _consultar(clave):
+    """
+    Estado actual de una vista: {id del turno: datos}. Se lee siempre de la primaria.
+    Los errores se propagan: una lista vacía por un error se vería como "se eliminó todo".
+    """
+    from db_manager import (buscar_guias_disponibles_por_fecha, obtener_disponibilidad_fechas,
+                            iniciar_contexto_lectura)
+    # La notificación llega al confirmarse la escritura; una réplica podría no tenerla todavía
+    iniciar_contexto_lectura(forzar_primaria=True)
+    if clave[0] == 'busqueda':
+        filas = buscar_guias_disponibles_por_fecha(date.fromisoformat(clave[1]), clave[2], propagar_errores=True)
+        return {fila['disponibilidad_id']: fila for fila in filas}
+    filas = obtener_disponibilidad_fechas(clave[1], propagar_errores=True)
+    return {fila['id']: {k: _serializable(v) for k, v in fila.items()} for fila in filas}
+
+def _es_afectada(clave, fechas, licencias, canal_guias):
+    if clave[0] == 'guia':
+        return clave[1] in licencias
+    # Un cambio de guía (aprobación, idiomas, perfil) puede afectar cualquier búsqueda
+    return canal_guias or clave[1] in fechas
+
+def calcular_diferencia(anterior, actual):
+    """Devuelve {'agregados': [...], 'modificados': [...], 'eliminados': [ids]} o None si no hay cambios."""
+    agregados = [datos for clave, datos in actual.items() if clave not in anterior]
+    modificados = [datos for clave, datos in actual.items() if clave in anterior and anterior[clave] != datos]
+    eliminados = [clave for clave in anterior if clave not in actual]
+    if not (agregados or modificados or eliminados):
+        return None
+    return {'agregados': agregados, 'modificados': modificados, 'eliminados': eliminados}
+
+def formatear_evento(nombre, datos):
+    return f"event: {nombre}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"
+
+# --------------------------------------------------------------------------
+# SUSCRIPTORES Y OYENTE COMPARTIDO
+# --------------------------------------------------------------------------
+
+class Suscriptor:
+    """Una conexión SSE. Los eventos ya formateados se leen de 'cola'."""
+
+    def __init__(self, clave):
+        self.clave = clave
+        self.cola = queue.Queue(maxsize=_COLA_MAXIMA)
+        self.desbordado = False
+
+    def enviar(self, evento):
+        try:
+            self.cola.put_nowait(evento)
+        except queue.Full:
+            # Cliente demasiado lento: se cierra su stream y al reconectar recibe el estado completo
+            self.desbordado = True
+
+class Oyente(threading.Thread):
+    """Hilo único por proceso: escucha NOTIFY y reparte las diferencias a los suscriptores."""
+
+    def __init__(self):
+        super().__init__(daemon=True, name='tiempo-real')
+        self._lock = threading.Lock()
+        self._vistas = {}          # clave -> {'suscriptores': set, 'instantanea': dict o None}
+        self._pendientes = set()   # vistas nuevas que esperan su primera consulta
+        self._lectura, self._escritura = os.pipe()   # Para despertar al hilo desde otra petición
+        self._vencimientos_desde = None   # Hora de la base hasta la que ya se revisaron vencimientos
+        self._revisar_en = 0              # time.monotonic() del próximo vencimiento de una retención
+        self.pid = os.getpid()
+
+    # ---- API usada por las peticiones ----
+
+    def suscribir(self, clave):
+        """Registra una conexión. Devuelve None si se alcanzó EVENTOS_MAX_CONEXIONES en este proceso."""
+        suscriptor = Suscriptor(clave)
+        with self._lock:
+            if sum(len(v['suscriptores']) for v in self._vistas.values()) >= EVENTOS_MAX_CONEXIONES:
+                return None
+            vista = self._vistas.setdefault(clave, {'suscriptores': set(), 'instantanea': None})
+            vista['suscriptores'].add(suscriptor)
+            nueva = vista['instantanea'] is None
+            if nueva:
+                self._pendientes.add(clave)
+            else:
+                suscriptor.enviar(formatear_evento('inicial', list(vista['instantanea'].values())))
+        if nueva:
+            os.write(self._escritura, b'x')
+        return suscriptor
+
+    def cancelar(self, suscriptor):
+        with self._lock:
+            vista = self._vistas.get(suscriptor.clave)
+            if vista:
+                vista['suscriptores'].discard(suscriptor)
+                if not vista['suscriptores']:
+                    del self._vistas[suscriptor.clave]
+
+    def conexiones(self):
+        with self._lock:
+            return sum(len(v['suscriptores']) for v in self._vistas.values())
+
+    # ---- Bucle del hilo ----
+
+    def run(self):
+        from db_manager import get_db_connection, CANAL_DISPONIBILIDAD, CANAL_GUIAS
+        while True:
+            conn = None
+            try:
+                conn = get_db_connection()
+                conn.autocommit = True
+                cursor = conn.cursor()
+                cursor.execute(f"LISTEN {CANAL_DISPONIBILIDAD}; LISTEN {CANAL_GUIAS};")
+                # Tras (re)conectar pudieron perderse notificaciones: refrescar todas las vistas
+                self._vencimientos_desde = None
+                self._revisar_vencimientos()
+                self._actualizar(todas=True)
+                while True:
+                    # Si hay vistas por (re)consultar tras un error, reintentar pronto
+                    with self._lock:
+                        espera = _RECONEXION_SEGUNDOS if self._pendientes else 60
+                    espera = max(0, min(espera, self._revisar_en - time.monotonic()))
+                    listos, _, _ = select.select([conn, self._lectura], [], [], espera)
+                    if self._lectura in listos:
+                        os.read(self._lectura, 4096)
+                    if conn in listos:
+                        # Agrupar ráfagas (p. ej. un rango de fechas del worker) en una sola actualización
+                        time.sleep(_AGRUPAR_SEGUNDOS)
+                        conn.poll()
+                        self._procesar(conn.notifies, CANAL_GUIAS)
+                        conn.notifies.clear()
+                    # Una reserva nueva puede vencer antes que el temporizador actual
+                    if conn in listos or time.monotonic() >= self._revisar_en:
+                        self._revisar_vencimientos()
+                    self._actualizar_pendientes()
+            except Exception as e:
+                print(f"Oyente de tiempo real desconectado, reintento en {_RECONEXION_SEGUNDOS}s: {e}")
+                time.sleep(_RECONEXION_SEGUNDOS)
+            finally:
+                if conn: conn.close()
+
+    def _procesar(self, notificaciones, canal_guias):
+        fechas, licencias, guias, todas = set(), set(), False, False
+        for notificacion in notificaciones:
+            try:
+                payload = json.loads(notificacion.payload)
+            except ValueError:
+                continue
+            todas = todas or payload.get('todas', False)
+            fechas.update(payload.get('fechas') or [])
+            licencias.update(payload.get('licencias') or [])
+            guias = guias or notificacion.channel == canal_guias
+        self._actualizar(todas=todas, fechas=fechas, licencias=licencias, canal_guias=guias)
+
+    def _revisar_vencimientos(self):
+        """Refresca las vistas con retenciones recién vencidas y programa el próximo vencimiento."""
+        from db_manager import obtener_retenciones_vencidas
+        try:
+            ahora, vencidas, proximo = obtener_retenciones_vencidas(self._vencimientos_desde)
+        except Exception as e:
+            print(f"Error al revisar vencimientos de retenciones, se reintentará: {e}")
+            self._revisar_en = time.monotonic() + _RECONEXION_SEGUNDOS
+            return
+        self._vencimientos_desde = ahora
+        segundos = (proximo - ahora).total_seconds() + _AGRUPAR_SEGUNDOS if proximo else 3600
+        self._revisar_en = time.monotonic() + segundos
+        if vencidas:
+            self._actualizar(fechas={fecha.isoformat() for fecha, _ in vencidas},
+                             licencias={licencia for _, licencia in vencidas})
+
+    def _actualizar_pendientes(self):
+        with self._lock:
+            pendientes, self._pendientes = self._pendientes, set()
+        for clave in pendientes:
+            self._refrescar(clave)
+
+    def _actualizar(self, todas=False, fechas=(), licencias=(), canal_guias=False):
+        with self._lock:
+            claves = [clave for clave in self._vistas
+                      if todas or _es_afectada(clave, fechas, licencias, canal_guias)]
+        for clave in claves:
+            self._refrescar(clave)
+
+    def _refrescar(self, clave):
+        """Consulta la vista una vez y envía a cada suscriptor el estado inicial o la diferencia."""
+        try:
+            actual = _consultar(clave)
+        except Exception as e:
+            # Sin datos no se envía nada: se conserva la instantánea y se reintenta más tarde
+            print(f"Error al consultar la vista {clave}, se reintentará: {e}")
+            with self._lock:
+                if clave in self._vistas:
+                    self._pendientes.add(clave)
+            return
+        with self._lock:
+            vista = self._vistas.get(clave)
+            if vista is None:
+                return
+            anterior, vista['instantanea'] = vista['instantanea'], actual
+            if anterior is None:
+                evento = formatear_evento('inicial', list(actual.values()))
+            else:
+                diferencia = calcular_diferencia(anterior, actual)
+                evento = formatear_evento('cambios', diferencia) if diferencia else None
+            if evento:
+                for suscriptor in vista['suscriptores']:
+                    suscriptor.enviar(evento)
+
+_oyente = None
+_oyente_lock = threading.Lock()
+
+def obtener_oyente():
+    """Oyente del proceso actual; se crea al primer uso (después del fork de gunicorn)."""
+    global _oyente
+    with _oyente_lock:
+        if _oyente is None or _oyente.pid != os.getpid():
+            _oyente = Oyente()
+            _oyente.start()
+        return _oyente
+
+# --------------------------------------------------------------------------
+# STREAM SSE
+# --------------------------------------------------------------------------
+
+def stream_eventos(suscriptor):
+    """Generador del cuerpo text/event-stream. Termina por duración máxima o cliente lento."""
+    oyente = obtener_oyente()
+    limite = time.monotonic() + EVENTOS_DURACION_MAXIMA
+    try:
+        yield f"retry: {_RECONEXION_SEGUNDOS * 1000}\n\n"
+        while time.monotonic() < limite and not suscriptor.desbordado:
+            try:
+                yield suscriptor.cola.get(timeout=EVENTOS_PING_SEGUNDOS)
+            except queue.Empty:
+                yield ": ping\n\n"   # Mantiene viva la conexión a través de proxies
+    finally:
+        oyente.cancelar(suscriptor)
@@ -0,0 +1,161 @@
+# worker.py - Procesa la cola de trabajos (tabla TRABAJOS) fuera del ciclo de las peticiones web.
+#
+# Se ejecuta como proceso independiente (ver Procfile: "worker: python worker.py").
+# Los trabajos se encolan desde app.py con db_manager.encolar_trabajo(tipo, payload).
+
+import os
+import socket
+import threading
+import time
+import traceback
+
+from db_manager import (
+    tomar_siguiente_trabajo, renovar_lease, completar_trabajo, fallar_trabajo,
+    encolar_trabajo_periodico, agregar_disponibilidad_fechas_masiva, archivar_disponibilidad_pasada,
+    recalcular_resumen_quejas, expirar_reservas_vencidas
+)
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+INTERVALO_ESPERA = float(os.environ.get('WORKER_INTERVALO', '2'))   # Segundos entre sondeos con la cola vacía
+LEASE_SEGUNDOS = int(os.environ.get('WORKER_LEASE', '300'))         # Tiempo sin renovar antes de considerar caído un trabajo
+BACKOFF_BASE = int(os.environ.get('WORKER_BACKOFF_BASE', '10'))     # Primer reintento a los 10 s, luego 20, 40...
+BACKOFF_MAXIMO = int(os.environ.get('WORKER_BACKOFF_MAX', '3600'))
+
+# --------------------------------------------------------------------------
+# REGISTRO DE TAREAS
+# --------------------------------------------------------------------------
+
+# tipo -> {'funcion': callable(payload) -> resultado, 'max_concurrencia': int}
+TAREAS = {}
+
+def tarea(tipo, max_concurrencia=1):
+    """Decorador para registrar una función como manejador de un tipo de trabajo.
+
+    max_concurrencia limita cuántos trabajos de ese tipo pueden ejecutarse a la vez
+    entre todos los workers.
+    """
+    def registrar(funcion):
+        TAREAS[tipo] = {'funcion': funcion, 'max_concurrencia': max_concurrencia}
+        return funcion
+    return registrar
+
+
+@tarea('disponibilidad_masiva', max_concurrencia=4)
+def tarea_disponibilidad_masiva(payload):
+    """payload: {'licencia': ..., 'franjas': [[fecha, hora_inicio, hora_fin], ...]}"""
+    franjas = [tuple(f) for f in payload.get('franjas', [])]
+    insertadas = agregar_disponibilidad_fechas_masiva(payload['licencia'], franjas)
+    return {'solicitadas': len(franjas), 'insertadas': insertadas}
+
+@tarea('archivar_disponibilidad')
+def tarea_archivar_disponibilidad(payload):
+    return archivar_disponibilidad_pasada(payload.get('tamano_lote', 5000))
+
+@tarea('recalcular_resumen_quejas')
+def tarea_recalcular_resumen_quejas(payload):
+    return {'quejas_contadas': recalcular_resumen_quejas()}
+
+@tarea('expirar_reservas')
+def tarea_expirar_reservas(payload):
+    # Las consultas ya ignoran las retenciones vencidas; esto solo deja el estado al día
+    return {'expiradas': expirar_reservas_vencidas()}
+
+# Trabajos periódicos: tipo -> intervalo en segundos
+PROGRAMACION = {
+    'archivar_disponibilidad': int(os.environ.get('ARCHIVADO_INTERVALO', '86400')),
+    'recalcular_resumen_quejas': int(os.environ.get('RESUMEN_QUEJAS_INTERVALO', '86400')),
+    'expirar_reservas': int(os.environ.get('EXPIRAR_RESERVAS_INTERVALO', '300')),
+}
+
+# --------------------------------------------------------------------------
+# BUCLE PRINCIPAL
+# --------------------------------------------------------------------------
+
+def calcular_backoff(intentos):
+    """Retraso exponencial (segundos) antes del siguiente reintento."""
+    return min(BACKOFF_BASE * (2 ** (intentos - 1)), BACKOFF_MAXIMO)
+
+class RenovadorLease(threading.Thread):
+    """Renueva el lease del trabajo en curso cada LEASE_SEGUNDOS / 3 mientras se ejecuta."""
+
+    def __init__(self, trabajo_id):
+        super().__init__(daemon=True, name=f'lease-{trabajo_id}')
+        self.trabajo_id = trabajo_id
+        self.perdido = False
+        self._detener = threading.Event()
+
+    def run(self):
+        while not self._detener.wait(LEASE_SEGUNDOS / 3):
+            # None es un error transitorio: el lease puede seguir vigente y se reintenta
+            if renovar_lease(self.trabajo_id, WORKER_ID, LEASE_SEGUNDOS) is False:
+                # Otro worker recuperó el trabajo: no tiene sentido seguir renovando
+                self.perdido = True
+                print(f"[{WORKER_ID}] Trabajo {self.trabajo_id}: se perdió el lease")
+                break
+
+    def detener(self):
+        self._detener.set()
+        self.join()
+
+def programar_periodicos():
+    """Encola los trabajos periódicos que ya cumplieron su intervalo."""
+    for tipo, intervalo in PROGRAMACION.items():
+        trabajo_id = encolar_trabajo_periodico(tipo, intervalo)
+        if trabajo_id:
+            print(f"[{WORKER_ID}] Trabajo periódico {tipo} programado (#{trabajo_id})")
+
+def procesar_un_trabajo():
+    """Toma y ejecuta un trabajo. Devuelve False si no había trabajo disponible."""
+    limites = {tipo: info['max_concurrencia'] for tipo, info in TAREAS.items()}
+    trabajo = tomar_siguiente_trabajo(WORKER_ID, limites, LEASE_SEGUNDOS)
+    if not trabajo:
+        return False
+
+    funcion = TAREAS[trabajo['tipo']]['funcion']
+    inicio = time.monotonic()
+    renovador = RenovadorLease(trabajo['id'])
+    renovador.start()
+    try:
+        resultado = funcion(trabajo['payload'])
+        renovador.detener()
+        if renovador.perdido:
+            print(f"[{WORKER_ID}] Trabajo {trabajo['id']} terminó pero perdió el lease durante la ejecución; resultado descartado")
+        elif completar_trabajo(trabajo['id'], WORKER_ID, resultado):
+            print(f"[{WORKER_ID}] Trabajo {trabajo['id']} ({trabajo['tipo']}) completado en {time.monotonic() - inicio:.2f}s")
+        else:
+            print(f"[{WORKER_ID}] Trabajo {trabajo['id']} terminó pero su lease ya no es de este worker; resultado descartado")
+    except Exception as e:
+        renovador.detener()
+        error = f"{e}\n{traceback.format_exc()}"
+        if renovador.perdido:
+            print(f"[{WORKER_ID}] Trabajo {trabajo['id']} falló después de perder el lease; el error no se registra: {e}")
+        elif trabajo['intentos'] < trabajo['max_intentos']:
+            espera = calcular_backoff(trabajo['intentos'])
+            fallar_trabajo(trabajo['id'], WORKER_ID, error, reintentar_en_segundos=espera)
+            print(f"[{WORKER_ID}] Trabajo {trabajo['id']} falló (intento {trabajo['intentos']}), reintento en {espera}s: {e}")
+        else:
+            fallar_trabajo(trabajo['id'], WORKER_ID, error)
+            print(f"[{WORKER_ID}] Trabajo {trabajo['id']} falló definitivamente: {e}")
+    return True
+
+def ejecutar():
+    print(f"Worker {WORKER_ID} iniciado. Tareas registradas: {', '.join(sorted(TAREAS))}")
+    ultima_programacion = 0
+    while True:
+        try:
+            if time.monotonic() - ultima_programacion >= 60:
+                programar_periodicos()
+                ultima_programacion = time.monotonic()
+            if not procesar_un_trabajo():
+                time.sleep(INTERVALO_ESPERA)
+        except KeyboardInterrupt:
+            print(f"Worker {WORKER_ID} detenido.")
+            break
+        except Exception as e:
+            # Errores de conexión u otros imprevistos: esperar y volver a intentar
+            print(f"[{WORKER_ID}] Error en el bucle del worker: {e}")
+            time.sleep(INTERVALO_ESPERA)
+
+
+if __name__ == '__main__':
+    ejecutar()